@@ -0,0 +1,242 @@
+import io
+import os
+import zlib
+import shutil
+import struct
+from bisect import bisect_right
+from typing import Iterable, List, Tuple
+
+from .utils import open_file, CHUNK_SIZE
+
+GZI_SUFFIX = '.gzi'
+BGZF_HEADER = b'\x1f\x8b\x08\x04'  # gzip magic bytes, deflate, FEXTRA flag
+BGZF_BLOCK_SIZE = 0xff00  # data per block: leaves room for incompressible data, blocks must not exceed 64 KiB
+BGZF_EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')  # empty block that ends files
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    """
+    Compress at most BGZF_BLOCK_SIZE bytes into a BGZF block: a gzip member with the total block size in the BC
+    subfield of the header.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)  # raw deflate, the gzip header is written here
+    compressed = compressor.compress(data) + compressor.flush()
+    header = BGZF_HEADER + b'\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00'
+    return b''.join((
+        header, struct.pack('<H', len(header) + 2 + len(compressed) + 8 - 1),
+        compressed, struct.pack('<II', zlib.crc32(data), len(data))
+    ))
+
+
+class BgzfWriter(io.RawIOBase):
+    """
+    Binary file object that writes BGZF (blocked gzip, like bgzip): gzip members of at most 64 KiB that can be
+    decompressed independently. Any gzip reader can read the file.
+
+    The offsets of the blocks are recorded while writing. If gzi is set, the BGZF index is saved when the file is
+    closed.
+    """
+
+    def __init__(self, file: str, level: int = 6, gzi: str = None):
+        self.path = file
+        self.level = level
+        self.gzi = gzi
+        self.offsets: List[Tuple[int, int]] = [(0, 0)]  # compressed and decompressed byte offset of each block
+        self._buffer = bytearray()
+        self._f = open(file, 'wb')
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: bytes) -> int:
+        self._buffer += data
+        if len(self._buffer) >= BGZF_BLOCK_SIZE:
+            n_full = len(self._buffer) // BGZF_BLOCK_SIZE * BGZF_BLOCK_SIZE
+            with memoryview(self._buffer) as view:
+                for start in range(0, n_full, BGZF_BLOCK_SIZE):
+                    self._write_block(view[start:start + BGZF_BLOCK_SIZE])
+            del self._buffer[:n_full]
+        return len(data)
+
+    def _write_block(self, data: bytes) -> None:
+        block = compress_block(data, level=self.level)
+        self._f.write(block)
+        compressed_offset, uncompressed_offset = self.offsets[-1]
+        self.offsets.append((compressed_offset + len(block), uncompressed_offset + len(data)))
+
+    def virtual_offset(self) -> int:
+        """
+        :return: virtual offset of the current position: byte offset of the block << 16 | offset within the block
+        """
+        return self.offsets[-1][0] << 16 | len(self._buffer)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._write_block(self._buffer)
+                self._buffer.clear()
+            self._f.write(BGZF_EOF)
+            self._f.close()
+            if self.gzi is not None:
+                _write_gzi(self.gzi, self.offsets[1:])
+        finally:
+            super().close()
+
+
+def _block_size(header: bytes, extra: bytes) -> int:
+    """
+    Find the BC subfield in the extra field of a gzip member header.
+
+    :return: total size of the BGZF block in bytes
+    """
+    pos = 0
+    while pos + 4 <= len(extra):
+        subfield_id, subfield_length = extra[pos:pos + 2], struct.unpack('<H', extra[pos + 2:pos + 4])[0]
+        if subfield_id == b'BC' and subfield_length == 2:
+            return struct.unpack('<H', extra[pos + 4:pos + 6])[0] + 1
+        pos += 4 + subfield_length
+    raise AssertionError(f'gzip member is not a BGZF block: no BC subfield! {header=}')
+
+
+def is_bgzf(file: str) -> bool:
+    """
+    Check whether a file is compressed using BGZF (blocked gzip, like bgzip), based on the header of the first block.
+    """
+    with open(file, 'rb') as f:
+        header = f.read(12)
+        if len(header) < 12 or not header.startswith(BGZF_HEADER):
+            return False
+        try:
+            _block_size(header, f.read(struct.unpack('<H', header[10:12])[0]))
+            return True
+        except AssertionError:
+            return False
+
+
+def iter_bgzf_blocks(file: str) -> Iterable[Tuple[int, int]]:
+    """
+    Walk the blocks of a BGZF file. Only the headers and the sizes at the end of the blocks are read, nothing is
+    decompressed.
+
+    :return: one tuple per block: byte offset of the block in the compressed file and in the decompressed data
+    """
+    compressed_offset, uncompressed_offset = 0, 0
+    with open(file, 'rb') as f:
+        while True:
+            header = f.read(12)
+            if not header:
+                return
+            assert len(header) == 12 and header.startswith(BGZF_HEADER), \
+                f'Not a BGZF block at byte {compressed_offset}! {file=}'
+            block_size = _block_size(header, f.read(struct.unpack('<H', header[10:12])[0]))
+            f.seek(compressed_offset + block_size - 4)
+            data_size = struct.unpack('<I', f.read(4))[0]  # ISIZE
+            yield compressed_offset, uncompressed_offset
+            compressed_offset += block_size
+            uncompressed_offset += data_size
+
+
+def save_gzi(file: str, out: str = None) -> str:
+    """
+    Create a samtools-compatible index of a BGZF file (.gzi): the offsets of all blocks but the first.
+
+    :param file: BGZF file
+    :param out: output file, default: {file}.gzi
+    :return: path to the index
+    """
+    if out is None:
+        out = file + GZI_SUFFIX
+    return _write_gzi(out, list(iter_bgzf_blocks(file))[1:])
+
+
+def _write_gzi(out: str, offsets: List[Tuple[int, int]]) -> str:
+    with open(out, 'wb') as f:
+        f.write(struct.pack('<Q', len(offsets)))
+        f.write(b''.join(struct.pack('<QQ', *offset) for offset in offsets))
+    return out
+
+
+def load_gzi(file: str) -> List[Tuple[int, int]]:
+    """
+    :param file: BGZF index (.gzi)
+    :return: list of tuples: byte offset of the block in the compressed file and in the decompressed data, starting
+    with the first block (0, 0)
+    """
+    with open(file, 'rb') as f:
+        n_offsets = struct.unpack('<Q', f.read(8))[0]
+        offsets = list(struct.iter_unpack('<QQ', f.read(16 * n_offsets)))
+    return [(0, 0), *offsets]
+
+
+def virtual_offset(gzi: List[Tuple[int, int]], offset: int) -> int:
+    """
+    Translate a byte offset in the decompressed data into a virtual offset.
+
+    :param gzi: offsets of the blocks, see load_gzi
+    :param offset: byte offset in the decompressed data
+    :return: byte offset of the block in the compressed file << 16 | offset within the decompressed block
+    """
+    i = bisect_right([uncompressed_offset for compressed_offset, uncompressed_offset in gzi], offset) - 1
+    compressed_offset, uncompressed_offset = gzi[i]
+    return compressed_offset << 16 | offset - uncompressed_offset
+
+
+def read_bgzf(file: str, offset: int, length: int, gzi: List[Tuple[int, int]] = None) -> bytes:
+    """
+    Read a range of the decompressed data of a BGZF file. Only the blocks that overlap the range are decompressed.
+
+    :param file: BGZF file
+    :param offset: byte offset in the decompressed data
+    :param length: number of bytes to read
+    :param gzi: offsets of the blocks, see load_gzi. default: load {file}.gzi, or walk the blocks if it does not exist
+    """
+    if gzi is None:
+        gzi = load_gzi(file + GZI_SUFFIX) if os.path.isfile(file + GZI_SUFFIX) else list(iter_bgzf_blocks(file))
+    voffset = virtual_offset(gzi, offset)
+    compressed_offset, skip = voffset >> 16, voffset & 0xffff
+
+    data = []
+    remaining = length + skip
+    with open(file, 'rb') as f:
+        f.seek(compressed_offset)
+        while remaining > 0:
+            header = f.read(12)
+            if not header:
+                break
+            extra = f.read(struct.unpack('<H', header[10:12])[0])
+            block = f.read(_block_size(header, extra) - 12 - len(extra))
+            decompressed = zlib.decompress(block[:-8], -15)
+            data.append(decompressed)
+            remaining -= len(decompressed)
+    return b''.join(data)[skip:skip + length]
+
+
+def compress_bgzf(file: str, out: str = None, level: int = 6, index: bool = True) -> str:
+    """
+    Compress a file using BGZF (blocked gzip, like bgzip). Compressed input files are decompressed first.
+
+    :param file: input file
+    :param out: output file, default: {file}.gz
+    :param level: compression level (1-9)
+    :param index: if true, write a BGZF index ({out}.gzi) in the same pass
+    :return: path to the BGZF index, or None
+    """
+    if out is None:
+        out = file + '.gz'
+    assert not os.path.isfile(out), f'Output file already exists! {out=}'
+    gzi = out + GZI_SUFFIX if index else None
+    with open_file(file, 'rb') as in_f, BgzfWriter(out, level=level, gzi=gzi) as out_f:
+        shutil.copyfileobj(in_f, out_f, CHUNK_SIZE)
+    return gzi
+
+
+def main():
+    import fire
+
+    fire.Fire(compress_bgzf)
+
+
+if __name__ == '__main__':
+    main()
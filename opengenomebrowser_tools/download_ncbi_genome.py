@@ -46,6 +46,12 @@ def download_ncbi_file(record_id: str, out: str, file: str):
     ftp_link = os.path.join(url, assembly_label + file)
     logging.info(f'Extracted {ftp_link=} from {record_id=}')
 
+    if out.endswith('.gz'):
+        # keep the file compressed, GenomeFiles can read it directly
+        request.urlretrieve(ftp_link, out)
+        logging.info(f'Downloaded {ftp_link=}')
+        return
+
     with TemporaryDirectory() as tempdir:
         # download
         gz_file = f'{tempdir}/{assembly_label}.{file}.gz'
@@ -57,12 +63,13 @@ def download_ncbi_file(record_id: str, out: str, file: str):
         logging.info(f'Decompressed {out=}')
 
 
-def download_ncbi_fna_gbk_gff(assembly_name: str, out_dir: str) -> (str, str, str):
+def download_ncbi_fna_gbk_gff(assembly_name: str, out_dir: str, decompress: bool = True) -> (str, str, str):
     record_id = get_record_id(assembly_name)
 
-    fna = os.path.join(out_dir, f'{assembly_name}.fna')
-    gbk = os.path.join(out_dir, f'{assembly_name}.gbk')
-    gff = os.path.join(out_dir, f'{assembly_name}.gff')
+    suffix = '' if decompress else '.gz'
+    fna = os.path.join(out_dir, f'{assembly_name}.fna{suffix}')
+    gbk = os.path.join(out_dir, f'{assembly_name}.gbk{suffix}')
+    gff = os.path.join(out_dir, f'{assembly_name}.gff{suffix}')
 
     download_ncbi_file(record_id=record_id, out=fna, file=f'_genomic.fna.gz')
     download_ncbi_file(record_id=record_id, out=gbk, file=f'_genomic.gbff.gz')
@@ -99,11 +106,8 @@ def rename_ncbi_files(
     gbk.rename(new_locus_tag_prefix=new_locus_tag_prefix, old_locus_tag_prefix=old_locus_tag_prefix, out=out_gbk,
                validate=validate, scf_prefix=scaffold_prefix, scf_leading_zeroes=leading_zeroes)
 
-    # produce ffn
-    GenBankToFasta.convert(gbk=out_gbk, out=out_ffn, format='ffn', strict=validate)
-
-    # produce faa
-    GenBankToFasta.convert(gbk=out_gbk, out=out_faa, format='faa', strict=validate)
+    # produce faa and ffn
+    GenBankToFasta.convert_multiple(gbk=out_gbk, faa=out_faa, ffn=out_ffn, strict=validate)
 
 
 def download_ncbi_genome(
@@ -145,7 +149,8 @@ def download_ncbi_genome(
         assert not os.path.isfile(file), f'Output file already exists! {file=}'
 
     with TemporaryDirectory() as tempdir:
-        raw_fna, raw_gbk, raw_gff = download_ncbi_fna_gbk_gff(assembly_name=assembly_name, out_dir=tempdir)
+        raw_fna, raw_gbk, raw_gff = download_ncbi_fna_gbk_gff(assembly_name=assembly_name, out_dir=tempdir,
+                                                              decompress=False)
 
         rename_ncbi_files(
             raw_fna, raw_gbk, raw_gff,
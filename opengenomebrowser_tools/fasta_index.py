@@ -0,0 +1,158 @@
+from collections import Counter
+from typing import List, Iterable, Optional
+
+import numpy as np
+
+from .utils import detect_compression, iter_line_blocks
+
+FAI_SUFFIX = '.fai'
+COUNTED_BASES = 'ACGTN'  # counted case-insensitively
+
+
+class FaiBuilder:
+    """
+    Compute a samtools-compatible FASTA index (.fai) while a FASTA file is streamed.
+
+    Feed it the content of the file in blocks of complete lines, from the start of the file. Each entry of the index
+    consists of: name (first word of the header), number of bases, byte offset of the first base, bases per line and
+    bytes per line (including the newline).
+
+    If count_bases is true, the bases (ACGTN, case-insensitive) are counted too, see assembly_stats. If check_lines is
+    false, the line lengths are not checked: only the names and the numbers of bases are correct, e.g. to compute the
+    statistics of a file that cannot be indexed anyway.
+    """
+
+    def __init__(self, path: str = None, count_bases: bool = False, check_lines: bool = True):
+        self.path = path  # only used in error messages
+        self.entries: List[list] = []
+        self.offset = 0  # number of bytes fed so far
+        self.base_counts: Optional[Counter] = Counter() if count_bases else None
+        self.check_lines = check_lines
+        self._short_line = False  # whether the current sequence already had a line shorter than the others
+        self._blank_line = False  # whether the current sequence already had a blank line
+
+    def feed(self, block: bytes) -> None:
+        pos = 0
+        headers = []
+        while pos < len(block):
+            if block[pos] == 62:  # '>'
+                end = block.find(b'\n', pos) + 1 or len(block)
+                headers.append(block[pos:end])
+                name = block[pos + 1:end].split(maxsplit=1)
+                assert name, f'FASTA header without name at byte {self.offset + pos}! {self.path=}'
+                self.entries.append([name[0].decode(), 0, self.offset + end, 0, 0])
+                self._short_line = self._blank_line = False
+                pos = end
+            else:
+                end = block.find(b'\n>', pos)
+                end = len(block) if end == -1 else end + 1
+                self._feed_sequence(block[pos:end], pos)
+                pos = end
+        self.offset += len(block)
+
+        if self.base_counts is not None:
+            # vectorized: count the bases of the whole block at once, then subtract the characters of the headers
+            upper_case = np.frombuffer(block, dtype=np.uint8) & 0xdf
+            headers = b''.join(headers).upper()
+            for base in COUNTED_BASES:
+                self.base_counts[base] += int(np.count_nonzero(upper_case == ord(base))) - headers.count(base.encode())
+
+    def _feed_sequence(self, sequence: bytes, pos: int) -> None:
+        assert self.entries, f'FASTA file does not start with a header! {self.path=}'
+        entry = self.entries[-1]
+        if not self.check_lines:
+            entry[1] += len(sequence) - sequence.count(b'\n') - sequence.count(b'\r')
+            return
+        if entry[4] == 0:  # first line of the sequence determines the line length
+            first_line = sequence[:sequence.find(b'\n') + 1 or len(sequence)]
+            entry[3] = len(first_line.rstrip(b'\r\n'))
+            entry[4] = len(first_line) if first_line.endswith(b'\n') else entry[3] + 1  # last line may lack newline
+        linebases, linewidth = entry[3], entry[4]
+
+        # fast path: a run of lines of full length: every linewidth-th byte is a newline and there are no others
+        n_lines = len(sequence) // linewidth
+        if not self._short_line and not self._blank_line \
+                and sequence[linewidth - 1:n_lines * linewidth:linewidth] == b'\n' * n_lines \
+                and sequence.count(b'\n', 0, n_lines * linewidth) == n_lines:
+            entry[1] += n_lines * linebases
+            sequence = sequence[n_lines * linewidth:]
+
+        for line in sequence.splitlines(keepends=True):
+            if not line.rstrip(b'\r\n'):
+                self._blank_line = True  # like samtools, accept blank lines at the end of a sequence
+                continue
+            assert not self._blank_line, \
+                f'Blank line within sequence {entry[0]} at byte {self.offset + pos}! {self.path=}'
+            assert not self._short_line, \
+                f'Different line length in sequence {entry[0]} at byte {self.offset + pos}! {self.path=}'
+            assert len(line) <= linewidth, \
+                f'Different line length in sequence {entry[0]} at byte {self.offset + pos}! {self.path=}'
+            entry[1] += len(line.rstrip(b'\r\n'))
+            self._short_line = len(line) < linewidth
+
+    def assembly_stats(self) -> dict:
+        """
+        Statistics of the assembly, based on the lengths of the sequences and the counted bases.
+
+        :return: dict: number of scaffolds, total length, length of the longest scaffold, GC content (percentage of
+        the ACGT bases), N50, L50 and N content (percentage of all bases)
+        """
+        assert self.base_counts is not None, f'The bases were not counted! {self.path=}'
+        lengths = sorted((entry[1] for entry in self.entries), reverse=True)
+        total_length = sum(lengths)
+
+        n50, l50, cumulative_length = 0, 0, 0
+        for l50, n50 in enumerate(lengths, start=1):
+            cumulative_length += n50
+            if 2 * cumulative_length >= total_length:
+                break
+
+        acgt = sum(self.base_counts[base] for base in 'ACGT')
+        gc = self.base_counts['G'] + self.base_counts['C']
+        n = self.base_counts['N']
+        return {
+            'assembly_nr_scaffolds': len(lengths),
+            'assembly_size': total_length,
+            'assembly_longest_scf': lengths[0] if lengths else 0,
+            'assembly_gc': round(100 * gc / acgt, 2) if acgt else None,
+            'assembly_n50': n50,
+            'assembly_l50': l50,
+            'assembly_n_content': round(100 * n / total_length, 4) if total_length else None,
+        }
+
+    def iter_lines(self) -> Iterable[str]:
+        for name, length, offset, linebases, linewidth in self.entries:
+            yield f'{name}\t{length}\t{offset}\t{linebases}\t{linewidth}\n'
+
+    def save(self, out: str) -> str:
+        with open(out, 'w') as f:
+            f.writelines(self.iter_lines())
+        return out
+
+
+def save_fai(fasta: str, out: str = None) -> str:
+    """
+    Create a samtools-compatible FASTA index (.fai) of an uncompressed FASTA file. The offsets are byte offsets into
+    the file, hence compressed files cannot be indexed.
+
+    :param fasta: input FASTA file
+    :param out: output file, default: {fasta}.fai
+    :return: path to the index
+    """
+    if out is None:
+        out = fasta + FAI_SUFFIX
+    assert detect_compression(fasta) is None, f'Cannot index compressed FASTA file! {fasta=}'
+    builder = FaiBuilder(path=fasta)
+    with open(fasta, 'rb') as f:
+        for block in iter_line_blocks(f):
+            builder.feed(block)
+    return builder.save(out)
+
+
+def load_fai(file: str) -> List[tuple]:
+    """
+    :param file: FASTA index (.fai)
+    :return: list of tuples: name, number of bases, byte offset, bases per line, bytes per line
+    """
+    with open(file) as f:
+        return [(name, *map(int, values)) for name, *values in (line.rstrip('\n').split('\t') for line in f)]
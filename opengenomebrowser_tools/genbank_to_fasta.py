@@ -1,41 +1,344 @@
 import io
 import os
 import logging
-from typing import Optional
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from functools import lru_cache, cached_property, partial
+from typing import Optional, Iterable, Tuple, Union, Callable
 
 from Bio import SeqIO, SeqRecord, SeqFeature
+from Bio.Seq import Seq
+from Bio.SeqFeature import Location, BeforePosition, AfterPosition
+from Bio.Data.IUPACData import ambiguous_dna_complement
+from Bio.Data.CodonTable import unambiguous_dna_by_id
+from .utils import open_file, iter_line_blocks, CHUNK_SIZE
+from .genbank_to_gff import iter_gff_lines, GFF_HEADER
+
+FASTA_LINE_LENGTH = 60
+FEATURE_FORMATS = ('faa', 'ffn')  # one entry per feature
+RECORD_FORMATS = ('fna', 'gff')  # one entry per record
+
+
+def _complement_table() -> bytes:
+    # like Bio.Seq.reverse_complement: IUPAC ambiguity codes, upper and lower case, U is treated as T
+    complement = dict(ambiguous_dna_complement, U=ambiguous_dna_complement['T'])
+    keys, values = ''.join(complement).encode(), ''.join(complement.values()).encode()
+    return bytes.maketrans(keys + keys.lower(), values + values.lower())
+
+
+COMPLEMENT_TABLE = _complement_table()
+
+
+def extract_sequence(location: Location, sequence: bytes) -> bytes:
+    """
+    Extract the sequence of a feature like location.extract(rec), but from the bytes of the record sequence, without
+    creating SeqRecord and Seq objects.
+
+    :param location: SimpleLocation or CompoundLocation, parts on the reverse strand are reverse-complemented
+    :param sequence: sequence of the record
+    """
+    parts = []
+    for part in location.parts:
+        if part.ref or part.ref_db:
+            raise ValueError(f'Feature references another sequence ({part.ref}), references mandatory')
+        seq = sequence[int(part.start):int(part.end)]
+        parts.append(seq.translate(COMPLEMENT_TABLE)[::-1] if part.strand == -1 else seq)
+    return b''.join(parts)
+
+
+class Codons(dict):
+    """
+    Lookup table of a genetic code: codon (bytes) -> amino acid, '*' for stop codons. Codons with ambiguous nucleotides
+    are translated by Biopython on first use and then cached. Like in Biopython, codons that may also be stop codons
+    (e.g. TGA in table 27) are translated to their amino acid.
+    """
+
+    def __init__(self, table_id: int):
+        table = unambiguous_dna_by_id[table_id]
+        super().__init__({codon.encode(): '*' for codon in table.stop_codons})
+        self.update((codon.encode(), amino_acid) for codon, amino_acid in table.forward_table.items())
+        self.start_codons = {codon.encode() for codon in table.start_codons}
+        self.stop_codons = {codon.encode() for codon in table.stop_codons}
+        self.table_id = table_id
+
+    def __missing__(self, codon: bytes) -> str:
+        amino_acid = str(Seq(codon).translate(table=self.table_id))
+        self[codon] = amino_acid
+        return amino_acid
+
+    @classmethod
+    @lru_cache
+    def for_table(cls, table_id: int) -> 'Codons':
+        return cls(table_id)
+
+
+def translate_cds(sequence: bytes, table_id: int = 1, codon_start: int = 1, complete_start: bool = True) -> str:
+    """
+    Translate a coding sequence like the /translation qualifier of GenBank files: alternative start codons are
+    translated to M, a final stop codon is removed and incomplete codons at the end are ignored.
+
+    :param sequence: coding sequence
+    :param table_id: NCBI genetic code (/transl_table)
+    :param codon_start: position of the first complete codon, 1, 2 or 3 (/codon_start)
+    :param complete_start: False if the 5' end of the coding sequence is missing (partial feature)
+    """
+    codons = Codons.for_table(table_id)
+    sequence = sequence[codon_start - 1:].upper()
+    end = len(sequence) - len(sequence) % 3
+    protein = ''.join([codons[sequence[i:i + 3]] for i in range(0, end, 3)])
+    if complete_start and codon_start == 1 and sequence[:3] in codons.start_codons:
+        protein = 'M' + protein[1:]
+    if protein.endswith('*') or sequence[end - 3:end] in codons.stop_codons:
+        protein = protein[:-1]
+    return protein
+
+
+def translate_feature(feature: SeqFeature, sequence: bytes) -> str:
+    """
+    Translate a CDS feature using its /transl_table and /codon_start qualifiers.
+
+    :param sequence: sequence of the record
+    """
+    table_id = int(feature.qualifiers.get('transl_table', ['1'])[0])
+    codon_start = int(feature.qualifiers.get('codon_start', ['1'])[0])
+    first_part = feature.location.parts[0]  # contains the 5' end
+    if first_part.strand == -1:
+        complete_start = not isinstance(first_part.end, AfterPosition)
+    else:
+        complete_start = not isinstance(first_part.start, BeforePosition)
+    return translate_cds(extract_sequence(feature.location, sequence), table_id=table_id, codon_start=codon_start,
+                         complete_start=complete_start)
+
+
+def format_fasta(header: str, sequence: str, line_length: int = FASTA_LINE_LENGTH) -> str:
+    """
+    Format one FASTA entry like Biopython's FASTA writer: header line without trailing whitespace, then the sequence
+    interrupted by newlines every line_length characters.
+
+    :param header: header without leading '>'
+    :param sequence: sequence without newlines
+    :return: FASTA entry, ends with a newline
+    """
+    lines = [f'>{header.rstrip()}\n']
+    lines.extend(sequence[i:i + line_length] + '\n' for i in range(0, len(sequence), line_length))
+    return ''.join(lines)
+
+
+def iter_record_chunks(f, chunk_size: int = CHUNK_SIZE) -> Iterable[Union[str, bytes]]:
+    """
+    Split a GenBank file into chunks of complete records, i.e. at the '//' lines that end each record.
+
+    :param f: GenBank file, opened in text or binary mode
+    :param chunk_size: approximate number of characters per chunk; records are never split, so chunks may be larger
+    :return: chunks of complete records
+    """
+    empty = f.read(0)  # '' or b''
+    newline, record_end = ('\n', '\n//') if type(empty) is str else (b'\n', b'\n//')
+    pending = []
+    for block in iter_line_blocks(f, chunk_size):
+        end = block.rfind(record_end) + 1  # start of the last '//' line
+        if end == 0 and not block.startswith(record_end[1:]):
+            pending.append(block)  # the current record continues in the next block
+            continue
+        end = block.find(newline, end) + 1 or len(block)
+        pending.append(block[:end])
+        yield empty.join(pending)
+        pending = [block[end:]]
+
+    if any(pending):
+        yield empty.join(pending)
+
+
+def _convert_records(text: str, formats: Tuple[str, ...]) -> list:
+    """
+    Turn a chunk of GenBank records into FASTA entries. May run in a worker process.
+    """
+    return list(GenBankToFasta._parse_entries(io.StringIO(text), formats=formats))
+
+
+def iter_features(lines: Iterable[str]) -> Iterable[Tuple[str, dict]]:
+    """
+    Parse the feature tables of GenBank records line by line. Header annotations and sequences are skipped.
+
+    :param lines: lines of a GenBank file
+    :return: one tuple per feature: key (e.g. 'CDS') and dict: qualifier -> list of values, like SeqFeature.qualifiers
+    """
+    in_features = False
+    key, qualifiers = None, None  # current feature
+    name, value = None, None  # qualifier whose quoted value may continue on the next line
+
+    for line in lines:
+        if not line.startswith(' '):
+            # keyword lines (FEATURES, ORIGIN, CONTIG, //, LOCUS, ...) end the current feature
+            if qualifiers is not None:
+                yield key, qualifiers
+                key, qualifiers = None, None
+            in_features = line.startswith('FEATURES')
+            continue
+        if not in_features:
+            continue
+
+        stripped = line.strip()
+        if not stripped:
+            continue  # blank padding line
+        if name is not None:
+            # continuation of a quoted value; like Biopython, join translations without blanks
+            value = value + stripped if name == 'translation' else f'{value} {stripped}'
+        elif line[5] != ' ':
+            if qualifiers is not None:
+                yield key, qualifiers
+            key, qualifiers = stripped.split(maxsplit=1)[0], {}  # new feature, the qualifiers follow
+            continue
+        elif stripped.startswith('/'):
+            name, _, value = stripped[1:].partition('=')
+        else:
+            continue  # continuation of the location
+
+        if value.count('"') % 2 == 0:  # the value is complete
+            if value.startswith('"') and value.endswith('"'):
+                value = value[1:-1].replace('""', '"')
+            qualifiers.setdefault(name, []).append(value)
+            name = None
+
+    if qualifiers is not None:
+        yield key, qualifiers
+
+
+def read_genbank_header(lines: Iterable[str]) -> Optional[SeqRecord]:
+    """
+    Parse the header annotations and the first feature of the first GenBank record. Reading stops at the second
+    feature, so the rest of the features and the sequence are never read.
+
+    :param lines: lines of a GenBank file
+    :return: SeqRecord with an undefined sequence of the length given in the LOCUS line, or None if the file is empty
+    """
+    header = []
+    in_features, n_features = False, 0
+    for line in lines:
+        if line.startswith(('ORIGIN', 'CONTIG', '//')):
+            break
+        if in_features and line.startswith('     ') and line[5:6].strip():  # feature key, not a blank line
+            n_features += 1
+            if n_features == 2:
+                break
+        header.append(line)
+        in_features = in_features or line.startswith('FEATURES')
+    if not header:
+        return None
+    return SeqIO.read(io.StringIO(''.join(header) + 'ORIGIN\n//\n'), 'genbank')
+
+
+class GenBankSummary:
+    """
+    Parse-once cache of a GenBank file: the header annotations and the first feature of the first record, read
+    without the sequence and the other features, and a summary of all features.
+
+    Use GenBankSummary.get(gbk): one instance is shared per path, size and mtime of the file.
+    """
+
+    def __init__(self, gbk: str):
+        self.path = gbk
+        with open_file(gbk) as f:
+            rec = read_genbank_header(f)
+        assert rec is not None and len(rec.features) > 0, f'Failed to get rec and feature from {gbk=}'
+        self.first_feature: SeqFeature = rec.features[0]
+        self.first_record: SeqRecord = rec
+
+    @classmethod
+    def get(cls, gbk: str) -> 'GenBankSummary':
+        stat = os.stat(gbk)
+        return cls._get(os.path.abspath(gbk), stat.st_size, stat.st_mtime_ns)
+
+    @classmethod
+    @lru_cache(maxsize=8)
+    def _get(cls, path: str, size: int, mtime_ns: int) -> 'GenBankSummary':
+        return cls(path)
+
+    @property
+    def annotations(self) -> dict:
+        return self.first_record.annotations
+
+    @cached_property
+    def feature_counts(self) -> Counter:
+        """
+        Number of features of each type (gene, CDS, ...) in all records. Only the feature tables are parsed.
+        """
+        with open_file(self.path) as f:
+            return Counter(key for key, qualifiers in iter_features(f))
+
+    def _genome_annotation_data(self, key: str) -> Optional[int]:
+        try:
+            return int(self.annotations['structured_comment']['Genome-Annotation-Data'][key])
+        except Exception:
+            return None
+
+    @property
+    def total_genes(self) -> Optional[int]:
+        return self._genome_annotation_data('Genes (total)')
+
+    @property
+    def total_proteins(self) -> Optional[int]:
+        return self._genome_annotation_data('CDSs (with protein)')
 
 
 class GenBankToFasta:
     @classmethod
-    def convert(cls, gbk, out: str, format: str, strict: bool = True):
+    def convert(cls, gbk, out: str, format: str, strict: bool = True, workers: int = 1):
         """
         Convert GenBank (gbk) file into protein FASTA (faa) or nucleotide FASTA (ffn)
 
         :param gbk: path to input GenBank file
         :param out: path to output file
         :param format: faa for protein FASTA, ffn for nucleotide FASTA
+        :param workers: number of processes that convert chunks of records in parallel
         """
-        assert not os.path.isfile(out), f'Output file already exists! {out=}'
         assert format in ('faa', 'ffn'), f'Format must be either faa or ffn! {format=}'
+        cls.convert_multiple(gbk=gbk, strict=strict, workers=workers, **{format: out})
 
-        with open(out, 'w') as f:
-            for line in cls._short_fasta_generator(gbk=gbk, format=format, strict=strict):
-                f.write(line)
+    @classmethod
+    def convert_multiple(cls, gbk, faa: str = None, ffn: str = None, fna: str = None, gff: str = None,
+                         strict: bool = True, workers: int = 1):
+        """
+        Convert GenBank (gbk) file into protein FASTA (faa), nucleotide FASTA (ffn), assembly FASTA (fna) and/or
+        general feature format (gff), parsing it only once
+
+        :param gbk: path to input GenBank file
+        :param faa: path to output protein FASTA file
+        :param ffn: path to output nucleotide FASTA file
+        :param fna: path to output assembly FASTA file
+        :param gff: path to output GFF3 file
+        :param workers: number of processes that convert chunks of records in parallel. If 1, convert in this process.
+        """
+        outs = {format: out for format, out in (('faa', faa), ('ffn', ffn), ('fna', fna), ('gff', gff)) if out is not None}
+        assert outs, f'No output file specified! {faa=} {ffn=} {fna=} {gff=}'
+        for out in outs.values():
+            assert not os.path.isfile(out), f'Output file already exists! {out=}'
+
+        with ExitStack() as stack:
+            files = {format: stack.enter_context(open_file(out, 'w')) for format, out in outs.items()}
+            try:
+                if 'gff' in files:
+                    files['gff'].write(GFF_HEADER)
+                for format, header, sequence in cls._iter_entries(gbk=gbk, formats=tuple(outs), strict=strict,
+                                                                  workers=workers):
+                    # gff entries are complete lines
+                    files[format].write(sequence if format == 'gff' else format_fasta(header, sequence))
+            except BaseException:
+                stack.close()
+                for out in outs.values():
+                    os.remove(out)
+                raise
 
     @classmethod
     def _short_fasta_generator(cls, gbk: str, format: str, strict: bool):
         """
         Generator that turns gbk-file into standard nucleotide FASTA-format.
 
-        The nucleotide sequence is interrupted by newlines every 50 bp.
+        The nucleotide sequence is interrupted by newlines every 60 bp.
         """
-
-        fasta = list(cls._long_fasta_generator(gbk=gbk, format=format, strict=strict))
-        fasta = '\n'.join(fasta)
-        fasta = io.StringIO(fasta)
-        for seq in SeqIO.parse(fasta, "fasta"):
-            yield seq.format("fasta")
+        for _, header, sequence in cls._iter_entries(gbk=gbk, formats=(format,), strict=strict):
+            yield format_fasta(header, sequence)
 
     @classmethod
     def _long_fasta_generator(cls, gbk: str, format: str, strict: bool):
@@ -44,29 +347,38 @@ class GenBankToFasta:
 
         The nucleotide sequence is not interrupted by newlines.
         """
+        for _, header, sequence in cls._iter_entries(gbk=gbk, formats=(format,), strict=strict):
+            yield f'>{header}\n{sequence}'
 
+    @staticmethod
+    def _feature_parser(format: str):
+        """
+        :return: function that turns a feature into locus_tag, gene_product and sequence, or None, None, None. Its
+        arguments are the feature and a function that returns the sequence of the record as bytes.
+        """
         if format == 'faa':
-            expected_entries = cls._get_total_proteins(gbk=gbk)
-            expected_type = 'proteins'
-
-            def parse_feature(feature: SeqFeature):
+            def parse_feature(feature: SeqFeature, get_sequence: Callable[[], bytes]):
                 if 'locus_tag' in feature.qualifiers and 'product' in feature.qualifiers and 'translation' in feature.qualifiers:
                     locus_tag = feature.qualifiers['locus_tag'][0]
                     gene_product = feature.qualifiers['product'][0]
                     sequence = feature.qualifiers['translation'][0]
                     return locus_tag, gene_product, sequence
+                elif 'locus_tag' in feature.qualifiers and 'product' in feature.qualifiers and feature.type == 'CDS' \
+                        and 'pseudo' not in feature.qualifiers and 'pseudogene' not in feature.qualifiers:
+                    # the annotation tool did not add the translation: translate the coding sequence
+                    locus_tag = feature.qualifiers['locus_tag'][0]
+                    gene_product = feature.qualifiers['product'][0]
+                    sequence = translate_feature(feature, get_sequence())
+                    return locus_tag, gene_product, sequence
                 else:
                     return None, None, None
 
         elif format == 'ffn':
-            expected_entries = cls._get_total_genes(gbk=gbk)
-            expected_type = 'genes'
-
-            def parse_feature(feature: SeqFeature):
+            def parse_feature(feature: SeqFeature, get_sequence: Callable[[], bytes]):
                 if 'locus_tag' in feature.qualifiers and 'product' in feature.qualifiers:
                     locus_tag = feature.qualifiers['locus_tag'][0]
                     gene_product = feature.qualifiers['product'][0]
-                    sequence = str(feature.location.extract(rec).seq)
+                    sequence = extract_sequence(feature.location, get_sequence()).decode()
                     return locus_tag, gene_product, sequence
                 else:
                     return None, None, None
@@ -74,51 +386,124 @@ class GenBankToFasta:
         else:
             raise AssertionError(f'Format must be either faa or ffn! {format=}')
 
-        locus_tags = set()
-        with open(gbk) as f:
-            for rec in SeqIO.parse(f, "genbank"):
-                for feature in rec.features:
-                    locus_tag, gene_product, sequence = parse_feature(feature=feature)
-                    if locus_tag is None:
-                        continue
+        return parse_feature
+
+    @staticmethod
+    def _record_converter(format: str):
+        """
+        :return: function that turns a record into a header (None for gff) and its content: the assembly sequence or
+        GFF3 lines. Its arguments are the record and a function that returns its sequence as bytes.
+        """
+        if format == 'fna':
+            def convert_record(rec: SeqRecord, get_sequence: Callable[[], bytes]):
+                return f'{rec.id} {rec.description}', get_sequence().decode()
+
+        elif format == 'gff':
+            def convert_record(rec: SeqRecord, get_sequence: Callable[[], bytes]):
+                return None, ''.join(iter_gff_lines(rec))
+
+        else:
+            raise AssertionError(f'Format must be either fna or gff! {format=}')
+
+        return convert_record
+
+    @classmethod
+    def _parse_entries(cls, handle, formats: Tuple[str, ...]) -> Iterable[Tuple[str, str, str, str]]:
+        """
+        Generator that turns GenBank records into FASTA entries of one or more formats.
+
+        :param handle: GenBank file, opened in text mode
+        :return: tuples of format, locus_tag, gene_product and sequence for faa and ffn, tuples of format, None, header
+        and content for the per-record formats fna and gff
+        """
+        parsers = {format: cls._feature_parser(format) for format in formats if format in FEATURE_FORMATS}
+        converters = {format: cls._record_converter(format) for format in formats if format in RECORD_FORMATS}
+        for rec in SeqIO.parse(handle, "genbank"):
+            get_sequence = lru_cache(maxsize=1)(partial(bytes, rec.seq))  # converted once, only if needed
+            for format, convert_record in converters.items():
+                yield format, None, *convert_record(rec=rec, get_sequence=get_sequence)
+            for feature in rec.features:
+                for format, parse_feature in parsers.items():
+                    locus_tag, gene_product, sequence = parse_feature(feature=feature, get_sequence=get_sequence)
+                    if locus_tag is not None:
+                        yield format, locus_tag, gene_product, sequence
+
+    @classmethod
+    def _parse_entries_parallel(cls, handle, formats: Tuple[str, ...], workers: int) -> Iterable[Tuple[str, str, str, str]]:
+        """
+        Like _parse_entries, but chunks of records are converted in worker processes. The entries are yielded in the
+        original order, and at most 2 * workers chunks are in memory at any time.
+        """
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = deque()
+            for chunk in iter_record_chunks(handle):
+                futures.append(executor.submit(_convert_records, chunk, formats))
+                if len(futures) >= 2 * workers:
+                    yield from futures.popleft().result()
+            while futures:
+                yield from futures.popleft().result()
+
+    @classmethod
+    def _iter_entries(
+            cls, gbk: str, formats: Tuple[str, ...], strict: bool, workers: int = 1
+    ) -> Iterable[Tuple[str, str, str]]:
+        """
+        Generator that turns gbk-file into entries of one or more formats in a single pass.
+
+        :return: tuples of format (faa, ffn, fna or gff), FASTA header (None for gff) and sequence (GFF3 lines for gff)
+        """
+        for format in formats:
+            # fail early on invalid formats
+            cls._record_converter(format) if format in RECORD_FORMATS else cls._feature_parser(format)
+        locus_tags = {format: set() for format in formats if format in FEATURE_FORMATS}
+
+        with open_file(gbk) as f:
+            if workers > 1:
+                entries = cls._parse_entries_parallel(f, formats=formats, workers=workers)
+            else:
+                entries = cls._parse_entries(f, formats=formats)
 
-                    # check if locus_tag is unique
-                    if locus_tag in locus_tags:
-                        logging.warning(f'GenBank is strange: {locus_tag} occurs multiple times!')
-                    locus_tags.add(locus_tag)
+            for format, locus_tag, gene_product, sequence in entries:
+                if format in RECORD_FORMATS:
+                    yield format, gene_product, sequence
+                    continue
 
-                    yield f'>{locus_tag} {gene_product}\n{sequence}'
+                # check if locus_tag is unique
+                if locus_tag in locus_tags[format]:
+                    logging.warning(f'GenBank is strange: {locus_tag} occurs multiple times!')
+                locus_tags[format].add(locus_tag)
+
+                yield format, f'{locus_tag} {gene_product}', sequence
+
+        msgs = []
+        for format in locus_tags:
+            if format == 'faa':
+                expected_entries, expected_type = cls._get_total_proteins(gbk=gbk), 'proteins'
+            else:
+                expected_entries, expected_type = cls._get_total_genes(gbk=gbk), 'genes'
+            if expected_entries is not None and expected_entries != len(locus_tags[format]):
+                msgs.append(f'GenBank is strange: Claims to have {expected_entries} {expected_type}, '
+                            f'but only has {len(locus_tags[format])} unique locus_tags!')
 
-        if expected_entries is not None and expected_entries != len(locus_tags):
-            msg = f'GenBank is strange: Claims to have {expected_entries} {expected_type}, but only has {len(locus_tags)} unique locus_tags!'
+        if msgs:
             if strict:
-                raise AssertionError(msg)
+                raise AssertionError(' '.join(msgs))
             else:
-                logging.warning(msg)
+                for msg in msgs:
+                    logging.warning(msg)
 
     @classmethod
     def _get_total_genes(cls, gbk: str) -> Optional[int]:
-        rec, feature = cls._get_first_gbk_rec_feature(gbk=gbk)
-        try:
-            return int(rec.annotations['structured_comment']['Genome-Annotation-Data']['Genes (total)'])
-        except Exception:
-            return None
+        return GenBankSummary.get(gbk).total_genes
 
     @classmethod
     def _get_total_proteins(cls, gbk: str) -> Optional[int]:
-        rec, feature = cls._get_first_gbk_rec_feature(gbk=gbk)
-        try:
-            return int(rec.annotations['structured_comment']['Genome-Annotation-Data']['CDSs (with protein)'])
-        except Exception:
-            return None
+        return GenBankSummary.get(gbk).total_proteins
 
     @classmethod
     def _get_first_gbk_rec_feature(cls, gbk: str) -> (SeqRecord, SeqFeature):
-        with open(gbk) as f:
-            for rec in SeqIO.parse(f, "genbank"):
-                for feature in rec.features:
-                    return rec, feature
-        raise AssertionError(f'Failed to get rec and feature from {gbk=}')
+        summary = GenBankSummary.get(gbk)
+        return summary.first_record, summary.first_feature
 
 
 def main():
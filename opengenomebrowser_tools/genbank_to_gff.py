@@ -0,0 +1,63 @@
+from typing import Iterable
+
+from Bio import SeqRecord, SeqFeature
+
+GFF_HEADER = '##gff-version 3\n'
+GFF_ESCAPE = str.maketrans({c: f'%{ord(c):02X}' for c in '%;=&,\t\n\r'})
+GFF_ATTRIBUTE_NAMES = {'db_xref': 'Dbxref', 'note': 'Note'}  # GenBank qualifier -> GFF3 attribute
+GFF_SKIP_QUALIFIERS = {'translation'}
+GFF_STRANDS = {1: '+', -1: '-'}
+
+
+def gff_escape(text: str) -> str:
+    return text.translate(GFF_ESCAPE)
+
+
+def _gff_attributes(feature: SeqFeature, seqid: str, genes: set) -> str:
+    """
+    Turn the qualifiers of a feature into column 9 of a GFF3 line. Features with locus tag get an ID based on it:
+    gene-{locus_tag}, cds-{locus_tag}, ... and, if the gene has been seen before, Parent=gene-{locus_tag}.
+    """
+    attributes = []
+    locus_tag = feature.qualifiers.get('locus_tag', [None])[0]
+    if feature.type == 'source':
+        attributes.append(f'ID={seqid}:{int(feature.location.start) + 1}..{int(feature.location.end)}')
+    elif locus_tag is not None:
+        attributes.append(f'ID={feature.type.lower()}-{gff_escape(locus_tag)}')
+        if feature.type == 'gene':
+            genes.add(locus_tag)
+        elif locus_tag in genes:
+            attributes.append(f'Parent=gene-{gff_escape(locus_tag)}')
+
+    for qualifier, values in feature.qualifiers.items():
+        if qualifier in GFF_SKIP_QUALIFIERS:
+            continue
+        values = ','.join(gff_escape(value) if value else 'true' for value in values)  # flags, e.g. /pseudo
+        attributes.append(f'{GFF_ATTRIBUTE_NAMES.get(qualifier, qualifier)}={values}')
+
+    return ';'.join(attributes)
+
+
+def iter_gff_lines(rec: SeqRecord) -> Iterable[str]:
+    """
+    Turn a GenBank record into GFF3 lines: a sequence-region pragma and one line per feature, or one line per part
+    of features with compound locations. The translations of CDSs are omitted.
+
+    :param rec: GenBank record
+    :return: lines that end with a newline
+    """
+    seqid = gff_escape(rec.id)
+    yield f'##sequence-region {seqid} 1 {len(rec.seq)}\n'
+
+    genes = set()  # locus tags of the genes of this record
+    for feature in rec.features:
+        gff_type = 'region' if feature.type == 'source' else gff_escape(feature.type)
+        attributes = _gff_attributes(feature, seqid=seqid, genes=genes)
+
+        phase = int(feature.qualifiers.get('codon_start', ['1'])[0]) - 1
+        length = 0  # length of the previous parts
+        for part in feature.location.parts:
+            strand = GFF_STRANDS.get(part.strand, '.')
+            part_phase = str((phase - length) % 3) if feature.type == 'CDS' else '.'
+            yield f'{seqid}\tGenBank\t{gff_type}\t{int(part.start) + 1}\t{int(part.end)}\t.\t{strand}\t{part_phase}\t{attributes}\n'
+            length += len(part)
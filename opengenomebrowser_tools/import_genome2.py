@@ -4,16 +4,21 @@ import json
 import yaml
 import shutil
 import tempfile
+from copy import copy
 from glob import glob
+from concurrent.futures import ProcessPoolExecutor
 from textwrap import shorten
-from typing import Union
+from typing import Union, Optional
+import numpy as np
 from schema import SchemaError
 
 from . import __folder_structure_version__
-from .utils import entrez_organism_to_taxid, GenomeFile, merge_json, get_folder_structure_version, WorkingDirectory
+from .utils import entrez_organism_to_taxid, GenomeFile, GeneIds, merge_json, get_folder_structure_version, \
+    WorkingDirectory
 from .rename_genbank import GenBankFile
 from .rename_gff import GffFile
 from .rename_fasta import FastaFile
+from .twobit import TWOBIT_SUFFIX
 from .rename_eggnog import EggnogFile
 from .parse_busco import parse_busco
 from .rename_custom_annotations import CustomAnnotationFile
@@ -34,9 +39,9 @@ class ImportSettings2:
             {'type': 'copy', 'from': '*', 'to': '{original_path}', 'expected': True},
         ],
         'file_finder': {
-            'fna': {'glob': '*.fna', 'expected': 1},
+            'fna': {'glob': '*.fna', 'expected': False},
             'gbk': {'glob': '*.gbk', 'expected': 1},
-            'gff': {'glob': '*.gff', 'expected': 1},
+            'gff': {'glob': '*.gff', 'expected': False},
             'faa': {'glob': '*.faa', 'expected': False},
             'sqn': {'glob': '*.sqn', 'expected': False},
             'ffn': {'glob': '*.ffn', 'expected': False},
@@ -224,21 +229,69 @@ def autodetect_organism_genome(root_dir: str) -> (str, str):
                          f'Please specify them manually.')
 
 
-def rename_all(root_dir: str, gbk: GenBankFile, files: [GenomeFile], new_prefix: str, old_prefix: str = None):
+def _rename_file(file: GenomeFile, path: str, out: str, **kwargs) -> Optional[np.ndarray]:
+    """
+    Rename a copy of file that points to path. May run in a worker process, hence path and out must be absolute.
+
+    :return: the gene ids of the renamed file if it was validated, see GenomeFile.gene_ids
+    """
+    file = copy(file)
+    file.path = path
+    file.rename(out=out, **kwargs)
+    return file.gene_ids
+
+
+def rename_all(root_dir: str, gbk: GenBankFile, files: [GenomeFile], new_prefix: str, old_prefix: str = None,
+               validate: bool = False, workers: int = 1):
+    """
+    Rename the locus tags of files (paths relative to root_dir) in place.
+
+    :param workers: number of processes that rename files in parallel. If 1, rename the files one after another.
+    :raises ImportException: if any file could not be renamed. Files are only replaced if all of them were renamed.
+    """
     if not old_prefix:
-        old_prefix = gbk.detect_locus_tag_prefix()
+        with WorkingDirectory(root_dir):
+            old_prefix = gbk.detect_locus_tag_prefix()
 
     assert new_prefix != old_prefix, \
         f'old and new locus_tag_prefix are the same! {old_prefix=} {new_prefix=}'
 
-    kwargs = dict(new_locus_tag_prefix=new_prefix, old_locus_tag_prefix=old_prefix, update_path=False)
+    kwargs = dict(new_locus_tag_prefix=new_prefix, old_locus_tag_prefix=old_prefix, validate=validate, update_path=False)
+
+    with tempfile.TemporaryDirectory() as rename_tempdir:
+        # use absolute paths: the working directory is global to the process
+        jobs = {
+            file: (os.path.join(os.path.abspath(root_dir), file.path), os.path.join(rename_tempdir, f'{i}.tempfile'))
+            for i, file in enumerate(files)
+        }
+
+        errors, gene_ids = {}, {}
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = {file: executor.submit(_rename_file, file, path, out, **kwargs)
+                           for file, (path, out) in jobs.items()}
+                for file, future in futures.items():
+                    try:
+                        gene_ids[file] = future.result()
+                    except Exception as e:
+                        errors[file] = e
+        else:
+            for file, (path, out) in jobs.items():
+                try:
+                    gene_ids[file] = _rename_file(file, path, out, **kwargs)
+                except Exception as e:
+                    errors[file] = e
+
+        if errors:
+            raise ImportException(f'Failed to rename {len(errors)} of {len(files)} files:\n' +
+                                  '\n'.join(f'{file}: {type(e).__name__}: {e}' for file, e in errors.items()))
 
-    with tempfile.TemporaryDirectory() as rename_tempdir, WorkingDirectory(root_dir):
-        for file in files:
-            temp_file = os.path.join(rename_tempdir, 'tempfile')
-            file.rename(out=temp_file, **kwargs)
-            os.remove(file.path)
-            os.rename(src=temp_file, dst=file.path)
+        for file, (path, out) in jobs.items():
+            os.replace(src=out, dst=path)
+            if validate and gene_ids[file] is not None:
+                # the locus tags were validated while renaming, check_files_ can skip this file
+                file.validated_locus_tag_prefix = new_prefix
+                file.gene_ids = gene_ids[file]
 
 
 def load_yaml_metadata(submol_yaml: str) -> (dict, dict):
@@ -277,9 +330,9 @@ def load_cog_metadata(custom_annotations: [GenomeFile]) -> dict:
 
 
 def add_files_to_json(genome_json: dict, files: dict, custom_annotations) -> dict:
-    def get(key):
+    def get(key, attr='path'):
         file = files[key]
-        return None if file is None else file.path
+        return None if file is None else getattr(file, attr)
 
     genome_json['cds_tool_faa_file'] = get('faa')
     genome_json['cds_tool_ffn_file'] = get('ffn')
@@ -287,6 +340,11 @@ def add_files_to_json(genome_json: dict, files: dict, custom_annotations) -> dic
     genome_json['cds_tool_gff_file'] = get('gff')
     genome_json['cds_tool_sqn_file'] = get('sqn')
     genome_json['assembly_fasta_file'] = get('fna')
+    for key, prefix in [('faa', 'cds_tool_faa'), ('ffn', 'cds_tool_ffn'), ('fna', 'assembly_fasta')]:
+        genome_json[f'{prefix}_fai'] = get(key, 'fai')
+        genome_json[f'{prefix}_gzi'] = get(key, 'gzi')
+    genome_json['cds_tool_gff_gzi'] = get('gff', 'gzi')
+    genome_json['assembly_2bit'] = get('fna', 'twobit')
     genome_json['custom_annotations'] = [
         {'date': ca.date_str(), 'file': ca.path, 'type': ca.custom_annotation_type}
         for ca in custom_annotations
@@ -301,6 +359,7 @@ def gather_metadata(import_settings: ImportSettings2, root_dir: str, files: [Gen
     Load metadata from:
       - pgap_submol.yaml
       - *.gbk
+      - *.fna (assembly statistics)
       - *_busco.txt
       - organism.json and genome.json
     :return:
@@ -327,6 +386,10 @@ def gather_metadata(import_settings: ImportSettings2, root_dir: str, files: [Gen
     organism_json.update(organism_gbk)
     genome_json.update(genome_gbk)
 
+    # add assembly statistics, computed while indexing the assembly
+    if files['fna'].stats is not None:
+        genome_json.update(files['fna'].stats)  # nr_replicons is not derived: scaffolds are not replicons
+
     # add _busco.txt
     try:
         busco_file = import_settings.find_file(type_='busco', root_dir=root_dir)
@@ -369,12 +432,49 @@ def gather_metadata(import_settings: ImportSettings2, root_dir: str, files: [Gen
 
 
 def check_files_(locus_tag_prefix, files: dict, custom_annotations: [GenomeFile]) -> None:
-    files['gbk'].validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
-    files['gff'].validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
-    files['faa'].validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
-    files['ffn'].validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
-    for ca in custom_annotations:
-        ca.validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
+    for file in [files['gbk'], files['gff'], files['faa'], files['ffn'], *custom_annotations]:
+        if file.validated_locus_tag_prefix == locus_tag_prefix and file.gene_ids is not None:
+            logging.info(f'Skipping validation of {file}: locus tags were already validated')
+            continue
+        file.validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
+
+    check_gene_ids(files, custom_annotations)
+
+
+def _format_gene_ids(gene_ids: np.ndarray, n: int = 10) -> str:
+    return ', '.join(GeneIds.digits(key) for key in gene_ids[:n]) + (', ...' if len(gene_ids) > n else '')
+
+
+def check_gene_ids(files: dict, custom_annotations: [GenomeFile]) -> None:
+    """
+    Check that all files describe the same genes, based on the sorted gene ids that were collected while the locus
+    tags were validated (see GenomeFile.gene_ids):
+      - all genes of gff, faa, ffn and custom annotations must occur in the gbk
+      - faa and ffn must contain each gene only once
+    Genes of the gbk that do not occur in the gff are logged. Other files may lack genes, e.g. faa lacks RNA genes.
+
+    :raises ImportException: if any file contains unknown or duplicate genes
+    """
+    gbk, gff = files['gbk'], files['gff']
+    known_gene_ids = np.unique(gbk.gene_ids)
+
+    errors = []
+    for file in [gff, files['faa'], files['ffn'], *custom_annotations]:
+        gene_ids = file.gene_ids
+        if file is files['faa'] or file is files['ffn']:
+            duplicates = np.unique(gene_ids[1:][gene_ids[1:] == gene_ids[:-1]])
+            if len(duplicates):
+                errors.append(f'{file}: {len(duplicates)} genes occur more than once: {_format_gene_ids(duplicates)}')
+        unknown = np.setdiff1d(gene_ids, known_gene_ids)
+        if len(unknown):
+            errors.append(f'{file}: {len(unknown)} genes do not occur in {gbk}: {_format_gene_ids(unknown)}')
+
+    missing = np.setdiff1d(known_gene_ids, gff.gene_ids)
+    if len(missing):
+        logging.warning(f'{len(missing)} genes of {gbk} do not occur in {gff}: {_format_gene_ids(missing)}')
+
+    if errors:
+        raise ImportException('The files do not contain the same genes (gene ids are shown):\n' + '\n'.join(errors))
 
 
 def import_genome2(
@@ -385,19 +485,25 @@ def import_genome2(
         rename: bool = False,
         check_files: bool = True,
         import_settings: str = None,
-        pause: bool = False
+        pause: bool = False,
+        workers: int = 1,
+        bgzf: bool = False,
+        twobit: bool = False
 ):
     """
     Easily import files into OpenGenomeBrowser folder structure.
 
-    :param import_dir: Folder with files to import. Required: [.fna, .faa, .gbk, .gff] Optional: [.ffn, .sqn, custom-annotation-files]
+    :param import_dir: Folder with files to import. Required: [.gbk] Optional: [.fna, .faa, .ffn, .gff, .sqn, custom-annotation-files]
     :param folder_structure_dir: Path to the root of the OpenGenomeBrowser folder structure. (Must contain 'organisms' folder.)
     :param organism: Name of the organism.
     :param genome: Identifier of the genome. Must start with organism. May be identical to organism.
     :param rename: Locus tag prefixes must match the genome identifier. If this is not the case, this script can automatically rename relevant files.
-    :param check_files: If true, check if locus tag prefixes match genome identifier.
+    :param check_files: If true, check if locus tag prefixes match genome identifier and if all files contain the same genes.
     :param import_settings: Path to import settings file. Alternatively, set the environment variable OGB_IMPORT_SETTINGS.
     :param pause: Wait after import_actions / before file_finder
+    :param workers: Number of processes that rename the files and convert the gbk to faa/ffn in parallel.
+    :param bgzf: If true, store fna, ffn, faa and gff compressed using BGZF. They remain randomly accessible via their indexes (.fai, .gzi).
+    :param twobit: If true, also store the assembly as packed UCSC .2bit file.
     """
     import_dir = os.path.abspath(import_dir)
 
@@ -446,26 +552,30 @@ def import_genome2(
         print(f'Files are prepared here: {work_dir.name} Press enter to continue with import. Press Ctrl+C to abort.')
         input()
 
-    fna: FastaFile = import_settings.find_file('fna', root_dir=work_dir.name, as_class=FastaFile)  # assembly
     gbk: GenBankFile = import_settings.find_file('gbk', root_dir=work_dir.name, as_class=GenBankFile)  # genbank
 
-    ffn = import_settings.find_file('ffn', root_dir=work_dir.name, as_class=FastaFile,
-                                    expected=False)  # nucleic acid sequences
-    if ffn is None:
-        logging.info(f'Failed to auto-detect ffn.')
-        ffn = gbk.path[:-4] + '.ffn'
-
-        gbk.create_ffn(ffn=f'{work_dir.name}/{ffn}')
-        ffn = FastaFile(ffn)  # nucleic acid sequences
-
-    faa = import_settings.find_file('faa', root_dir=work_dir.name, as_class=FastaFile, expected=False)  # protein
-    if faa is None:
-        logging.info(f'Failed to auto-detect faa.')
-        faa = gbk.path[:-4] + '.faa'
-        gbk.create_faa(faa=f'{work_dir.name}/{faa}')
-        faa = FastaFile(faa)  # protein
+    found = {
+        'fna': import_settings.find_file('fna', root_dir=work_dir.name, as_class=FastaFile, expected=False),  # assembly
+        'ffn': import_settings.find_file('ffn', root_dir=work_dir.name, as_class=FastaFile, expected=False),  # nucleic acid sequences
+        'faa': import_settings.find_file('faa', root_dir=work_dir.name, as_class=FastaFile, expected=False),  # protein
+        'gff': import_settings.find_file('gff', root_dir=work_dir.name, as_class=GffFile, expected=False),  # general feature format
+    }
 
-    gff: GffFile = import_settings.find_file('gff', root_dir=work_dir.name, as_class=GffFile)  # general feature format
+    # create missing files with a single pass over the gbk
+    create = {}
+    for suffix, file in found.items():
+        if file is None:
+            logging.info(f'Failed to auto-detect {suffix}. Creating it based on the gbk.')
+            create[suffix] = gbk.path[:-4] + f'.{suffix}'
+    if create:
+        gbk.create_files(**{suffix: f'{work_dir.name}/{path}' for suffix, path in create.items()}, workers=workers)
+        for suffix, path in create.items():
+            found[suffix] = (GffFile if suffix == 'gff' else FastaFile)(path)
+
+    fna: FastaFile = found['fna']
+    ffn: FastaFile = found['ffn']
+    faa: FastaFile = found['faa']
+    gff: GffFile = found['gff']
     sqn: GenomeFile = import_settings.find_file('sqn', root_dir=work_dir.name,
                                                 as_class=GenomeFile, expected=False)  # general feature format
 
@@ -478,9 +588,33 @@ def import_genome2(
         rename_all(
             root_dir=work_dir.name, gbk=gbk,
             files=[gbk, gff, faa, ffn, *custom_annotations],
-            new_prefix=f'{genome}_'
+            new_prefix=f'{genome}_',
+            validate=check_files,
+            workers=workers
         )
 
+    # index the FASTA files: contigs and genes can be read without scanning the files
+    # the locus tags of faa and ffn are validated in the same pass, unless this happened during renaming
+    for file in [fna, ffn, faa]:
+        validate = check_files and file is not fna and file.validated_locus_tag_prefix != f'{genome}_'
+        try:
+            file.save_indexes(
+                locus_tag_prefix=f'{genome}_' if validate else None,
+                twobit=os.path.splitext(file.path)[0] + TWOBIT_SUFFIX if twobit and file is fna else None,
+                count_bases=file is fna
+            )
+        except AssertionError as e:
+            # the indexes are optional, but invalid locus tags are not: validate them on their own
+            if validate:
+                file.validate_locus_tags(locus_tag_prefix=f'{genome}_')
+                file.validated_locus_tag_prefix = f'{genome}_'
+            logging.warning(f'Failed to index {file}, it is imported without indexes: {e}')
+            file.fai = None
+
+    if bgzf:
+        for file in [fna, ffn, faa, gff]:
+            file.compress_bgzf()
+
     organism_json, genome_json = gather_metadata(import_settings, root_dir=work_dir.name, files=files,
                                                  custom_annotations=custom_annotations,
                                                  organism_dir=organism_dir, import_dir=import_dir, organism=organism,
@@ -489,6 +623,9 @@ def import_genome2(
     if check_files:
         check_files_(locus_tag_prefix=f'{genome}_', files=files, custom_annotations=custom_annotations)
 
+    # index the records of the gbk: single contigs can be read without scanning the whole file
+    gbk.save_record_index()
+
     # final movement
     os.makedirs(os.path.dirname(genome_dir), exist_ok=True)
     shutil.copytree(src=work_dir.name, dst=genome_dir, symlinks=True)
@@ -48,6 +48,15 @@ genome_json_schema = Schema({
     'assembly_version': Or(str, None),
     'assembly_date': Or(is_valid_date, None),
     'nr_replicons': Or(int, None),
+    # statistics of the assembly, computed during import
+    # missing in genomes imported before they were introduced
+    Optional('assembly_nr_scaffolds'): Or(int, None),
+    Optional('assembly_size'): Or(int, None),
+    Optional('assembly_longest_scf'): Or(int, None),
+    Optional('assembly_gc'): Or(int, float, None),
+    Optional('assembly_n50'): Or(int, None),
+    Optional('assembly_l50'): Or(int, None),
+    Optional('assembly_n_content'): Or(int, float, None),
     'cds_tool': Or(str, None),
     'cds_tool_date': Or(is_valid_date, None),
     'cds_tool_version': Or(str, None),
@@ -57,6 +66,16 @@ genome_json_schema = Schema({
     'cds_tool_gff_file': str,
     'cds_tool_sqn_file': Or(str, None),
     'assembly_fasta_file': str,
+    # indexes (.fai, .gzi) of the FASTA files and the gff, packed assembly (.2bit)
+    # missing in genomes imported before they were introduced
+    Optional('cds_tool_faa_fai'): Or(str, None),
+    Optional('cds_tool_faa_gzi'): Or(str, None),
+    Optional('cds_tool_ffn_fai'): Or(str, None),
+    Optional('cds_tool_ffn_gzi'): Or(str, None),
+    Optional('assembly_fasta_fai'): Or(str, None),
+    Optional('assembly_fasta_gzi'): Or(str, None),
+    Optional('cds_tool_gff_gzi'): Or(str, None),
+    Optional('assembly_2bit'): Or(str, None),
     'custom_annotations': [{
         "date": is_valid_date,
         "file": str,
@@ -108,6 +127,13 @@ genome_json_dummy = {
     "assembly_version": None,
     "assembly_date": None,
     "nr_replicons": None,
+    "assembly_nr_scaffolds": None,
+    "assembly_size": None,
+    "assembly_longest_scf": None,
+    "assembly_gc": None,
+    "assembly_n50": None,
+    "assembly_l50": None,
+    "assembly_n_content": None,
     "cds_tool": None,
     "cds_tool_date": None,
     "cds_tool_version": None,
@@ -117,6 +143,14 @@ genome_json_dummy = {
     "cds_tool_gff_file": dummy,
     "cds_tool_sqn_file": None,
     "assembly_fasta_file": dummy,
+    "cds_tool_faa_fai": None,
+    "cds_tool_faa_gzi": None,
+    "cds_tool_ffn_fai": None,
+    "cds_tool_ffn_gzi": None,
+    "assembly_fasta_fai": None,
+    "assembly_fasta_gzi": None,
+    "cds_tool_gff_gzi": None,
+    "assembly_2bit": None,
     "custom_annotations": [],
     "BUSCO": {},
     "COG": {},
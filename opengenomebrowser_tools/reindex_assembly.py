@@ -1,7 +1,14 @@
 import os
 
+from .utils import open_file, iter_line_blocks, COMPRESSION_SUFFIXES
+from .fasta_index import FaiBuilder
+from .twobit import TwoBitBuilder
 
-def reindex_assembly(file: str, out: str, prefix: str, leading_zeroes: int = None):
+
+def reindex_assembly(
+        file: str, out: str, prefix: str, leading_zeroes: int = None,
+        fai: str = None, header_map: str = None, twobit: str = None
+):
     """
     Change the header line of FASTA to: f'>{prefix}_{counter}'.
 
@@ -9,22 +16,53 @@ def reindex_assembly(file: str, out: str, prefix: str, leading_zeroes: int = Non
     :param out: output file
     :param prefix: desired prefix
     :param leading_zeroes: format counter with leading zeroes (optional). e.g.: 5 -> >PREFIX_00001
+    :param fai: write a samtools-compatible index of the output file to this path (optional), e.g. f'{out}.fai'
+    :param header_map: write a tab-separated table of the old and the new headers to this path (optional)
+    :param twobit: write a packed UCSC .2bit file of the output to this path (optional)
     """
     assert not os.path.isfile(out), f'Output file already exists! {out=}'
+    assert fai is None or COMPRESSION_SUFFIXES.get(os.path.splitext(out)[1]) is None, \
+        f'Cannot index compressed output file! {out=}'
 
     if type(leading_zeroes) is int and leading_zeroes > 1:
-        format = lambda c: f'>{prefix}{str(c).zfill(leading_zeroes)}\n'
+        format = lambda c: f'>{prefix}{str(c).zfill(leading_zeroes)}\n'.encode()
     else:
-        format = lambda c: f'>{prefix}{c}\n'
+        format = lambda c: f'>{prefix}{c}\n'.encode()
 
     counter = 0
-    with open(file) as in_f, open(out, 'w') as out_f:
-        for line in in_f:
-            if line.startswith('>'):
+    headers = []  # tuples: old header, new header
+    fai_builder = FaiBuilder(path=out)
+    twobit_builder = TwoBitBuilder(path=out) if twobit else None
+    with open_file(file, 'rb') as in_f, open_file(out, 'wb') as out_f:
+        for block in iter_line_blocks(in_f):
+            if b'\r' in block:
+                # like text mode: write the output with \n line endings only
+                block = block.replace(b'\r\n', b'\n').replace(b'\r', b'\n')
+            # each piece but the first starts with a header line
+            first, *pieces = (b'\n' + block).split(b'\n>')
+            new_block = [first]
+            for piece in pieces:
                 counter += 1
-                out_f.write(format(counter))
-            else:
-                out_f.write(line)
+                header_end = piece.find(b'\n') + 1 or len(piece)
+                new_header = format(counter)
+                new_block.extend((b'\n', new_header, piece[header_end:]))
+                headers.append((piece[:header_end].rstrip(b'\r\n').decode(), new_header[1:-1].decode()))
+            new_block = b''.join(new_block)[1:]
+            out_f.write(new_block)
+            if fai:
+                fai_builder.feed(new_block)
+            if twobit:
+                twobit_builder.feed(new_block)
+
+    if fai:
+        fai_builder.save(fai)
+
+    if twobit:
+        twobit_builder.save(twobit)
+
+    if header_map:
+        with open(header_map, 'w') as f:
+            f.writelines(f'{old}\t{new}\n' for old, new in headers)
 
 
 def main():
@@ -1,4 +1,6 @@
-from .utils import GenomeFile, split_locus_tag
+from typing import Union
+
+from .utils import GenomeFile, GeneIds, split_locus_tag, open_file, to_str
 
 
 class CustomAnnotationFile(GenomeFile):
@@ -19,28 +21,32 @@ class CustomAnnotationFile(GenomeFile):
     ) -> None:
         old_locus_tag_prefix = self._pre_rename_check(out, new_locus_tag_prefix, old_locus_tag_prefix)
 
-        with open(self.path) as in_f:
-            content = in_f.readlines()
+        binary = self._binary_mode()
+        encode, decode = (str.encode, bytes.decode) if binary else (str, str)
+        tab = encode('\t')
+        old, new = encode(old_locus_tag_prefix), encode(new_locus_tag_prefix)
+        gene_ids = GeneIds()
 
-        def rename_line(line: str):
-            assert line.startswith(
-                old_locus_tag_prefix), f'custom_annotations_file line does not contain old_locus_tag_prefix!' \
-                                       f'{old_locus_tag_prefix=}, {line=}, {self.path=}'
-            return line.replace(old_locus_tag_prefix, new_locus_tag_prefix, 1)
+        def rename_line(line: Union[str, bytes]):
+            assert line.startswith(old), f'custom_annotations_file line does not contain old_locus_tag_prefix!' \
+                                         f'{old_locus_tag_prefix=}, line={to_str(line)!r}, {self.path=}'
+            line = line.replace(old, new, 1)
+            if validate:
+                gene_ids.add(self._validate_locus_tag(decode(line.split(tab, 1)[0]), new_locus_tag_prefix, path=out))
+            return line
 
-        content = [rename_line(line) for line in content]
+        with open_file(self.path, 'rb' if binary else 'r') as in_f, \
+                open_file(out, 'wb' if binary else 'w') as out_f:
+            out_f.writelines(map(rename_line, in_f))
 
-        with open(out, 'w') as out_f:
-            out_f.writelines(content)
+        if validate:
+            self.gene_ids = gene_ids.sorted()
 
         if update_path:
             self.path = out
 
-        if validate:
-            self.validate_locus_tags(locus_tag_prefix=new_locus_tag_prefix)
-
     def detect_locus_tag_prefix(self) -> str:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             line = f.readline()
             locus_tag = line.split('\t', 1)[0]
             locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
@@ -51,14 +57,14 @@ class CustomAnnotationFile(GenomeFile):
         if locus_tag_prefix is None:
             locus_tag_prefix = self.detect_locus_tag_prefix()
 
-        with open(self.path) as f:
+        binary = self._binary_mode()
+        tab, decode = (b'\t', bytes.decode) if binary else ('\t', str)
+        gene_ids = GeneIds()
+        with open_file(self.path, 'rb' if binary else 'r') as f:
             for line in f:
-                locus_tag = line.split('\t')[0]
-                real_locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
-
-                assert real_locus_tag_prefix == locus_tag_prefix, \
-                    f'locus_tag_prefix in {self.path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
-                assert gene_id.isdigit(), f'locus_tag in {self.path=} is malformed. expected: {locus_tag_prefix}_[0-9]+ reality: {locus_tag}'
+                locus_tag = line.split(tab, 1)[0]
+                gene_ids.add(self._validate_locus_tag(decode(locus_tag), locus_tag_prefix))
+        self.gene_ids = gene_ids.sorted()
 
 
 def rename_custom_annotations(file: str, out: str, new_locus_tag_prefix: str, old_locus_tag_prefix: str = None,
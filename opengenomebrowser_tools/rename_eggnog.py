@@ -1,8 +1,9 @@
 from re import compile
 from datetime import datetime
 from functools import cached_property
+from typing import Union
 
-from .utils import GenomeFile, split_locus_tag, get_cog_categories
+from .utils import GenomeFile, GeneIds, split_locus_tag, get_cog_categories, open_file, to_str
 
 EGGNOG_VERSIONS = {
     'eggnog-2.1.2':
@@ -23,32 +24,37 @@ class EggnogFile(GenomeFile):
     ) -> None:
         old_locus_tag_prefix = self._pre_rename_check(out, new_locus_tag_prefix, old_locus_tag_prefix)
 
-        with open(self.path) as in_f:
-            content = in_f.readlines()
+        binary = self._binary_mode()
+        encode, decode = (str.encode, bytes.decode) if binary else (str, str)
+        comment, tab = encode('#'), encode('\t')
+        old, new = encode(old_locus_tag_prefix), encode(new_locus_tag_prefix)
+        gene_ids = GeneIds()
 
-        def rename_line(line: str):
-            if line.startswith('#'):
+        def rename_line(line: Union[str, bytes]):
+            if line.startswith(comment):
                 return line
 
-            locus_tag, rest = line.split('\t', 1)
-            locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
+            locus_tag, rest = line.split(tab, 1)
+            locus_tag_prefix, gene_id = split_locus_tag(decode(locus_tag))
             assert locus_tag_prefix == old_locus_tag_prefix, f'Eggnog line does not contain old_locus_tag_prefix!' \
-                                                             f'{old_locus_tag_prefix=}, {line=}, {self.path=}'
-            return locus_tag.replace(old_locus_tag_prefix, new_locus_tag_prefix, 1) + '\t' + rest
+                                                             f'{old_locus_tag_prefix=}, line={to_str(line)!r}, {self.path=}'
+            locus_tag = locus_tag.replace(old, new, 1)
+            if validate:
+                gene_ids.add(self._validate_locus_tag(decode(locus_tag), new_locus_tag_prefix, path=out))
+            return locus_tag + tab + rest
 
-        content = [rename_line(line) for line in content]
+        with open_file(self.path, 'rb' if binary else 'r') as in_f, \
+                open_file(out, 'wb' if binary else 'w') as out_f:
+            out_f.writelines(map(rename_line, in_f))
 
-        with open(out, 'w') as out_f:
-            out_f.writelines(content)
+        if validate:
+            self.gene_ids = gene_ids.sorted()
 
         if update_path:
             self.path = out
 
-        if validate:
-            self.validate_locus_tags(locus_tag_prefix=new_locus_tag_prefix)
-
     def detect_locus_tag_prefix(self) -> str:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             for line in f:
                 if line.startswith('#'):
                     continue
@@ -60,7 +66,7 @@ class EggnogFile(GenomeFile):
         raise KeyError(f'Could not extract locus_tag from {self.path=}, it does not appear to contain annotations!')
 
     def date(self) -> datetime:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             head = [next(f) for x in range(4)]
 
         if head[0].startswith('##'):
@@ -76,7 +82,7 @@ class EggnogFile(GenomeFile):
 
     @cached_property
     def custom_annotation_type(self) -> str:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             head = '\n'.join(next(f) for x in range(5))  # read 5 lines
 
         for type, columns_header in EGGNOG_VERSIONS.items():
@@ -89,17 +95,17 @@ class EggnogFile(GenomeFile):
         if locus_tag_prefix is None:
             locus_tag_prefix = self.detect_locus_tag_prefix()
 
-        with open(self.path) as f:
+        binary = self._binary_mode()
+        comment, tab, decode = (b'#', b'\t', bytes.decode) if binary else ('#', '\t', str)
+        gene_ids = GeneIds()
+        with open_file(self.path, 'rb' if binary else 'r') as f:
             for line in f:
-                if line.startswith('#'):
+                if line.startswith(comment):
                     continue
 
-                locus_tag = line.split('\t', 1)[0]
-                real_locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
-
-                assert real_locus_tag_prefix == locus_tag_prefix, \
-                    f'locus_tag_prefix in {self.path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
-                assert gene_id.isdigit(), f'locus_tag in {self.path=} is malformed. expected: {locus_tag_prefix}_[0-9]+ reality: {locus_tag}'
+                locus_tag = line.split(tab, 1)[0]
+                gene_ids.add(self._validate_locus_tag(decode(locus_tag), locus_tag_prefix))
+        self.gene_ids = gene_ids.sorted()
 
     def cog_categories(self) -> dict:
         cog_categories = get_cog_categories()
@@ -110,7 +116,7 @@ class EggnogFile(GenomeFile):
         cog_to_count['-'] = 0  # eggnog assigns '-' sometimes; surely it means the same as 'S': Function unknown
         n_genes = 0
 
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             for line in f:
                 if line.startswith('#'):
                     continue
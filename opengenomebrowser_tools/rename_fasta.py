@@ -1,40 +1,88 @@
+import os
+import re
+import mmap
 import logging
+from functools import lru_cache, cached_property
+from typing import Union, Callable, Optional, Iterable, List, Tuple
 
-from .utils import GenomeFile, split_locus_tag
+from .utils import GenomeFile, GeneIds, split_locus_tag, open_file, iter_line_blocks, to_str, detect_compression, \
+    CHUNK_SIZE
+from .fasta_index import FaiBuilder, load_fai, FAI_SUFFIX
+from .bgzf import is_bgzf, save_gzi, load_gzi, read_bgzf, GZI_SUFFIX
+from .twobit import TwoBitBuilder, TwoBitFile
+
+HEADER_LINE = re.compile(rb'\n(>[^\n]*)')  # starts with a literal: the regex engine skips sequences quickly
+HEADER_INDEX_SUFFIX = '.headers.tsv'
+MMAP_WINDOW_SIZE = 16 * CHUNK_SIZE
+
+
+@lru_cache
+def valid_header_pattern(locus_tag_prefix: str) -> Optional[re.Pattern]:
+    """
+    Compile a regex that matches a newline and the following header line if FastaFile.parse_fasta_header accepts it
+    for locus_tag_prefix. Group 1 is the gene id.
+
+    :return: None if such header lines could be rejected for other reasons (e.g. the prefix ends in a digit)
+    """
+    if not locus_tag_prefix or '_' not in locus_tag_prefix or locus_tag_prefix[-1].isdigit() \
+            or any(c in locus_tag_prefix for c in ' |\n'):
+        return None
+    return re.compile(rf'\n>(?:[^ \n]*\|)?{re.escape(locus_tag_prefix)}([0-9]+)(?: [^\n]*|[ \t\r\f\v]*)(?![^\n])')
 
 
 class FastaFile(GenomeFile):
+    fai: str = None  # set by save_indexes
+    twobit: str = None
+    stats: dict = None
+
     def rename(self, out: str, new_locus_tag_prefix: str, old_locus_tag_prefix: str = None,
                validate: bool = False, update_path: bool = True) -> None:
         old_locus_tag_prefix = self._pre_rename_check(out, new_locus_tag_prefix, old_locus_tag_prefix)
 
-        with open(self.path) as in_f:
-            content = in_f.readlines()
+        binary = self._binary_mode()
+        encode = str.encode if binary else str
+        old, new = encode(old_locus_tag_prefix), encode(new_locus_tag_prefix)
+        old_hypothetical = encode(f'hypothetical protein {old_locus_tag_prefix}')
+        new_hypothetical = encode(f'hypothetical protein {new_locus_tag_prefix}')
 
-        def rename_line(line: str):
-            if line.startswith('>'):
-                assert old_locus_tag_prefix in line, \
-                    f'Fasta header does not contain old_locus_tag_prefix! {old_locus_tag_prefix=}, {line=}, fasta={self.path}'
-                return line \
-                    .replace(old_locus_tag_prefix, new_locus_tag_prefix, 1) \
-                    .replace(f'hypothetical protein {old_locus_tag_prefix}',
-                             f'hypothetical protein {new_locus_tag_prefix}')
-            else:
-                return line
+        def rename_header(header: Union[str, bytes]):
+            assert old in header, \
+                f'Fasta header does not contain old_locus_tag_prefix! {old_locus_tag_prefix=}, ' \
+                f'header={to_str(header)!r}, fasta={self.path}'
+            return header.replace(old, new, 1).replace(old_hypothetical, new_hypothetical)
 
-        content = [rename_line(line) for line in content]
+        header_start, newline = encode('>'), encode('\n')
+        old_header, new_header = header_start + old, header_start + new
 
-        with open(out, 'w') as out_f:
-            out_f.writelines(content)
+        def rename_block(block: Union[str, bytes]):
+            # fast path: if every header starts with the old prefix, the whole block is renamed at once
+            first_header_ok = block.startswith(old_header) or not block.startswith(header_start)
+            if not first_header_ok or block.count(newline + old_header) != block.count(newline + header_start):
+                return self._map_headers(block, rename_header)
+            if block.startswith(old_header):
+                block = new_header + block[len(old_header):]
+            return block.replace(newline + old_header, newline + new_header).replace(old_hypothetical, new_hypothetical)
 
-        if update_path:
-            self.path = out
+        # stream block by block: memory usage does not depend on the size of the file
+        # if validate is true, the new headers are checked while writing; the output is not read again
+        gene_ids = GeneIds()
+        with open_file(self.path, 'rb' if binary else 'r') as in_f, \
+                open_file(out, 'wb' if binary else 'w') as out_f:
+            for block in iter_line_blocks(in_f):
+                block = rename_block(block)
+                out_f.write(block)
+                if validate:
+                    self._validate_headers(self._get_headers(block), locus_tag_prefix=new_locus_tag_prefix, path=out,
+                                           gene_ids=gene_ids)
 
         if validate:
-            self.validate_locus_tags(locus_tag_prefix=new_locus_tag_prefix)
+            self.gene_ids = gene_ids.sorted()
+
+        if update_path:
+            self.path = out
 
     def detect_locus_tag_prefix(self) -> str:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             for line in f:
                 if not line.startswith('>'):
                     assert line.strip() == '', f'Could not extract locus_tag from {self.path=}, it does not start with a header line!'
@@ -46,13 +94,266 @@ class FastaFile(GenomeFile):
             f'Could not extract locus_tag from {self.path=}, it does not appear to contain a header line (>)!')
 
     def validate_locus_tags(self, locus_tag_prefix: str = None):
-        with open(self.path) as f:
-            for line in f:
-                if line.startswith('>'):
-                    real_locus_tag_prefix, gene_id = self.parse_fasta_header(header=line)
-                assert real_locus_tag_prefix == locus_tag_prefix, \
-                    f'locus_tag_prefix in {self.path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
-                assert gene_id.isdigit(), f'locus_tag in {self.path=} is malformed. gene_id is expected to be: [0-9]+ reality: {gene_id}'
+        gene_ids = GeneIds()
+        if self._binary_mode():
+            for headers in self._iter_header_lines():
+                self._validate_headers(headers, locus_tag_prefix=locus_tag_prefix, gene_ids=gene_ids)
+        else:
+            with open_file(self.path) as f:
+                for block in iter_line_blocks(f):
+                    self._validate_headers(self._get_headers(block), locus_tag_prefix=locus_tag_prefix,
+                                           gene_ids=gene_ids)
+        self.gene_ids = gene_ids.sorted()
+
+    def iter_header_offsets(self) -> Iterable[Tuple[int, str]]:
+        """
+        Yield the byte offset (of '>') and the header (without '>') of each record. Sequences are skipped.
+        """
+        for buffer, start, end, offset in self._iter_line_windows():
+            if buffer[start:start + 1] == b'>':
+                first_line_end = buffer.find(b'\n', start, end)
+                yield offset, buffer[start + 1:end if first_line_end == -1 else first_line_end].decode().rstrip('\r')
+            for match in HEADER_LINE.finditer(buffer, start, end):
+                yield offset + match.start(1) - start, match.group(1)[1:].decode().rstrip('\r')
+
+    def save_header_index(self, out: str = None) -> str:
+        """
+        Save the header offset table as a tab-separated file: byte offset of '>' and header (without '>').
+
+        :param out: output file, default: {self.path}.headers.tsv
+        :return: path to the header index
+        """
+        if out is None:
+            out = self.path + HEADER_INDEX_SUFFIX
+        with open(out, 'w') as f:
+            f.writelines(f'{offset}\t{header}\n' for offset, header in self.iter_header_offsets())
+        return out
+
+    def load_header_index(self, file: str = None) -> List[Tuple[int, str]]:
+        """
+        :param file: header index, default: {self.path}.headers.tsv
+        :return: list of tuples: byte offset of '>' and header (without '>')
+        """
+        if file is None:
+            file = self.path + HEADER_INDEX_SUFFIX
+        with open(file) as f:
+            return [(int(offset), header) for offset, header in (line.rstrip('\n').split('\t', 1) for line in f)]
+
+    def save_indexes(self, locus_tag_prefix: str = None, twobit: str = None, count_bases: bool = False) \
+            -> (Optional[str], Optional[str]):
+        """
+        Create a samtools-compatible FASTA index ({self.path}.fai) and, if the file is BGZF-compressed, a BGZF index
+        ({self.path}.gzi). Files compressed using plain gzip or zstd do not allow random access and are not indexed.
+
+        :param locus_tag_prefix: if set, validate the headers in the same pass over the file
+        :param twobit: if set, also create a packed .2bit file of the (nucleotide) sequences at this path
+        :param count_bases: if true, compute assembly statistics in the same pass and store them in self.stats
+        :return: paths to the fai and the gzi, or None if they were not created. Also stored in self.fai and self.gzi.
+        """
+        compression = detect_compression(self.path)
+        indexable = compression is None or is_bgzf(self.path)
+        if not indexable:
+            logging.warning(f'Cannot index {self.path}: {compression} compressed files do not allow random access. '
+                            f'Use BGZF compression instead.')
+
+        fai_builder = FaiBuilder(path=self.path, count_bases=count_bases, check_lines=indexable)
+        twobit_builder = None if twobit is None else TwoBitBuilder(path=self.path)
+        gene_ids = GeneIds()
+        for buffer, start, end, offset in self._iter_line_windows():
+            block = buffer[start:end]
+            fai_builder.feed(block)
+            if twobit_builder is not None:
+                twobit_builder.feed(block)
+            if locus_tag_prefix is not None:
+                self._validate_headers(self._window_headers(buffer, start, end), locus_tag_prefix=locus_tag_prefix,
+                                       gene_ids=gene_ids)
+        if locus_tag_prefix is not None:
+            self.validated_locus_tag_prefix = locus_tag_prefix
+            self.gene_ids = gene_ids.sorted()
+        if twobit_builder is not None:
+            self.twobit = twobit_builder.save(twobit)
+        if count_bases:
+            self.stats = fai_builder.assembly_stats()
+
+        if indexable:
+            self.fai = fai_builder.save(self.path + FAI_SUFFIX)
+            self.gzi = None if compression is None else save_gzi(self.path)
+        return self.fai, self.gzi
+
+    def compress_bgzf(self) -> str:
+        fai = self.fai
+        gzi = super().compress_bgzf()
+        if fai is not None:
+            # the offsets in the fai refer to the decompressed data and remain valid
+            self.fai = self.path + FAI_SUFFIX
+            os.replace(fai, self.fai)
+        return gzi
+
+    def get_sequence(self, name: str, start: int = 0, end: int = None) -> str:
+        """
+        Read (a part of) a sequence using the FASTA index, without scanning the file. Works for uncompressed and BGZF
+        files; save_indexes must have been run.
+
+        :param name: first word of the header
+        :param start: 0-based start position
+        :param end: 0-based end position (exclusive), default: end of the sequence
+        :return: the sequence without newlines
+        """
+        assert name in self._fai_entries, f'Sequence not in index! {name=} {self.path=}'
+        length, offset, linebases, linewidth = self._fai_entries[name]
+        end = length if end is None else min(end, length)
+        if start >= end:
+            return ''
+        first = offset + start // linebases * linewidth + start % linebases
+        last = offset + (end - 1) // linebases * linewidth + (end - 1) % linebases + 1
+        if detect_compression(self.path) is None:
+            with open(self.path, 'rb') as f:
+                f.seek(first)
+                data = f.read(last - first)
+        else:
+            data = read_bgzf(self.path, first, last - first, gzi=self._gzi_offsets)
+        return data.replace(b'\n', b'').replace(b'\r', b'').decode()
+
+    def open_2bit(self, twobit: str = None) -> TwoBitFile:
+        """
+        Open the packed .2bit version of this file for random access, see save_indexes.
+
+        :param twobit: path to the .2bit file, default: self.twobit
+        """
+        twobit = twobit or self.twobit
+        assert twobit is not None, f'No .2bit file known for {self.path=}. Run save_indexes(twobit=...) first.'
+        return TwoBitFile(twobit)
+
+    @cached_property
+    def _fai_entries(self) -> dict:
+        return {name: values for name, *values in load_fai(self.fai or self.path + FAI_SUFFIX)}
+
+    @cached_property
+    def _gzi_offsets(self) -> list:
+        return load_gzi(self.gzi or self.path + GZI_SUFFIX)
+
+    def _iter_header_lines(self) -> Iterable[str]:
+        """
+        Yield the header lines (with '>') of the file window by window, separated by newlines. Sequences are skipped.
+        """
+        for buffer, start, end, offset in self._iter_line_windows():
+            headers = self._window_headers(buffer, start, end)
+            if headers:
+                yield headers
+
+    @staticmethod
+    def _window_headers(buffer: Union[bytes, mmap.mmap], start: int, end: int) -> str:
+        """
+        :return: the header lines (with '>') in buffer[start:end], separated by newlines
+        """
+        headers = HEADER_LINE.findall(buffer, start, end)
+        if buffer[start:start + 1] == b'>':
+            first_line_end = buffer.find(b'\n', start, end)
+            headers.insert(0, buffer[start:end if first_line_end == -1 else first_line_end])
+        return b'\n'.join(headers).decode()
+
+    def _iter_line_windows(self) -> Iterable[Tuple[Union[bytes, mmap.mmap], int, int, int]]:
+        """
+        Uncompressed files are memory-mapped, compressed files are decompressed block by block.
+
+        :return: tuples of buffer, start, end and offset: buffer[start:end] consists of complete lines and begins at
+        byte offset 'offset' of the (decompressed) file
+        """
+        if detect_compression(self.path) is None:
+            if os.path.getsize(self.path) == 0:
+                return  # empty files cannot be memory-mapped
+            with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                start = 0
+                while start < len(mm):
+                    end = mm.find(b'\n', start + MMAP_WINDOW_SIZE) + 1 or len(mm)
+                    yield mm, start, end, start
+                    start = end
+        else:
+            offset = 0
+            with open_file(self.path, 'rb') as f:
+                for block in iter_line_blocks(f):
+                    yield block, 0, len(block), offset
+                    offset += len(block)
+
+    @staticmethod
+    def _split_records(block: Union[str, bytes]) -> (list, int):
+        """
+        Split a block of complete FASTA lines at the beginning of each header line.
+
+        :return: list of records that start with a header (without '>'), except the first one, and the index of the
+        first record that starts with a header (0 or 1). The records can be joined using '\\n>'.
+        """
+        header_start, separator = ('>', '\n>') if type(block) is str else (b'>', b'\n>')
+        records = block.split(separator)
+        if records[0].startswith(header_start):
+            records[0] = records[0][1:]
+            return records, 0
+        return records, 1
+
+    @classmethod
+    def _get_headers(cls, block: Union[str, bytes]) -> str:
+        """
+        Extract all header lines (with '>') in a block of complete FASTA lines. Sequences are skipped.
+
+        :return: the header lines, separated by newlines, decoded all at once
+        """
+        header_start, newline = ('>', '\n') if type(block) is str else (b'>', b'\n')
+        records, first = cls._split_records(block)
+        if first == len(records):
+            return ''
+        return to_str(header_start + (newline + header_start).join(
+            record.partition(newline)[0] for record in records[first:]
+        ))
+
+    @classmethod
+    def _map_headers(cls, block: Union[str, bytes], fn: Callable) -> Union[str, bytes]:
+        """
+        Apply fn to all headers (without '>' and newline) in a block of complete FASTA lines. Sequences are copied.
+        """
+        header_start, newline = ('>', '\n') if type(block) is str else (b'>', b'\n')
+        records, first = cls._split_records(block)
+        for i in range(first, len(records)):
+            record = records[i]
+            end = record.find(newline)
+            if end == -1:
+                end = len(record)
+            records[i] = fn(record[:end]) + record[end:]
+        if first == 0:
+            records[0] = header_start + records[0]
+        return (newline + header_start).join(records)
+
+    def _validate_headers(self, headers: str, locus_tag_prefix: str, path: str = None,
+                          gene_ids: GeneIds = None) -> None:
+        """
+        :param headers: header lines, separated by newlines
+        :param gene_ids: if set, add the gene ids of the headers
+        """
+        if not headers:
+            return
+        pattern = valid_header_pattern(locus_tag_prefix)
+        if pattern is not None:
+            valid_gene_ids = pattern.findall('\n' + headers)
+            if len(valid_gene_ids) == headers.count('\n') + 1:
+                # fast path: all headers are valid
+                if gene_ids is not None:
+                    gene_ids.extend(valid_gene_ids)
+                return
+        for header in headers.split('\n'):
+            gene_id = self._validate_header(header, locus_tag_prefix=locus_tag_prefix, path=path)
+            if gene_ids is not None:
+                gene_ids.add(gene_id)
+
+    def _validate_header(self, header: str, locus_tag_prefix: str, path: str = None) -> str:
+        """
+        :return: the gene id (digits)
+        """
+        if path is None:
+            path = self.path
+        real_locus_tag_prefix, gene_id = self.parse_fasta_header(header=header)
+        assert real_locus_tag_prefix == locus_tag_prefix, \
+            f'locus_tag_prefix in {path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
+        assert gene_id.isdigit(), f'locus_tag in {path=} is malformed. gene_id is expected to be: [0-9]+ reality: {gene_id}'
+        return gene_id
 
     @staticmethod
     def parse_fasta_header(header: str) -> (str, str):
@@ -1,13 +1,54 @@
+import io
 import os
+import re
 import logging
+from functools import lru_cache
+from typing import Iterable, Optional, Union, Dict, Tuple
 
 from Bio import SeqIO, SeqRecord, SeqFeature
-from .utils import GenomeFile, query_int, entrez_organism_to_taxid, date_to_string, datetime, create_replace_function, \
-    split_locus_tag
-from .genbank_to_fasta import GenBankToFasta
+from .utils import GenomeFile, GeneIds, query_int, entrez_organism_to_taxid, date_to_string, datetime, split_locus_tag, \
+    stream_replace, open_file, iter_line_blocks, to_str, detect_compression, CHUNK_SIZE
+from .bgzf import is_bgzf, read_bgzf
+from .genbank_to_fasta import GenBankToFasta, GenBankSummary, iter_features, iter_record_chunks
+
+LOCUS_TAG_QUALIFIER = re.compile(r'^ +/locus_tag="([^"\n]*)"', flags=re.MULTILINE)
+# starts with a literal: the regex engine skips all other lines quickly
+LOCUS_TAG_VALUE = re.compile(r'/locus_tag="([^"\n]*)"[ \t]*$', flags=re.MULTILINE)
+LOCUS_TAG_VALUE_BYTES = re.compile(LOCUS_TAG_VALUE.pattern.encode(), flags=re.MULTILINE)
+QUALIFIER_INDENT = ' ' * 21
+RECORD_INDEX_SUFFIX = '.records.tsv'
+FEATURE_KEY_LINE = re.compile(rb'\n {5}[^ \n]')  # in the feature table, feature keys are indented by 5 spaces
+KEYWORD_LINE = re.compile(rb'\n[^ \n]')  # e.g. ORIGIN or CONTIG, ends the feature table
+
+
+@lru_cache
+def valid_locus_tag_pattern(locus_tag_prefix: str, binary: bool = False) -> Optional[re.Pattern]:
+    """
+    Compile a regex that matches a newline and the following locus tag if GenomeFile._validate_locus_tag accepts it
+    for locus_tag_prefix. Group 1 is the gene id.
+
+    :return: None if such locus tags could be rejected for other reasons (e.g. the prefix ends in a digit)
+    """
+    if not locus_tag_prefix or locus_tag_prefix[-1].isdigit() or any(c in locus_tag_prefix for c in '|\n'):
+        return None
+    pattern = rf'\n(?:[^\n]*\|)?{re.escape(locus_tag_prefix)}([0-9]+)(?![^\n])'
+    return re.compile(pattern.encode() if binary else pattern)
+
+
+def iter_feature_qualifiers(lines: Iterable[str]) -> Iterable[dict]:
+    """
+    Parse the feature tables of GenBank records line by line. Header annotations and sequences are skipped.
+
+    :param lines: lines of a GenBank file
+    :return: one dict per feature: qualifier -> list of values, like SeqFeature.qualifiers
+    """
+    for key, qualifiers in iter_features(lines):
+        yield qualifiers
 
 
 class GenBankFile(GenomeFile):
+    _record_index: Tuple[str, dict] = None  # used by get_record: path and content of the loaded record index
+
     def rename(
             self,
             out: str,
@@ -20,43 +61,70 @@ class GenBankFile(GenomeFile):
     ) -> None:
         old_locus_tag_prefix = self._pre_rename_check(out, new_locus_tag_prefix, old_locus_tag_prefix)
 
-        with open(self.path) as in_f:
-            content = in_f.readlines()
-
-        if scf_prefix:
-            # change scf prefixes
-            if type(scf_leading_zeroes) is int and scf_leading_zeroes > 1:
-                format = lambda c: f'VERSION     {scf_prefix}{str(c).zfill(scf_leading_zeroes)}\n'
-            else:
-                format = lambda c: f'VERSION     {scf_prefix}{c}\n'
-
-            counter = 0
-            for i, line in enumerate(content):
-                if line.startswith('VERSION'):
-                    counter += 1
-                    content[i] = format(counter)
-
-        content = ''.join(content)
         # change locus tags
-        replace_fn = create_replace_function({
+        replace_map = {
             string.format(prefix=old_locus_tag_prefix): string.format(prefix=new_locus_tag_prefix)
             for string in ['/locus_tag="{prefix}', '/protein_id="extdb:{prefix}', ':{prefix}']
-        })
+        }
 
-        old_hash = hash(content)
-        content = replace_fn(content)
-        assert old_hash != hash(content), f'The content of {self.path=} has not changed!'
+        with open_file(self.path) as in_f, open_file(out, 'w') as out_f:
+            if scf_prefix:
+                chunks = self._reindex_scaffolds(in_f, scf_prefix=scf_prefix, scf_leading_zeroes=scf_leading_zeroes)
+            else:
+                chunks = iter(lambda: in_f.read(CHUNK_SIZE), '')
+
+            if validate:
+                # check the new locus tags while writing; the output is not read again unless some /locus_tag
+                # qualifiers cannot be read line by line (e.g. because their values span multiple lines)
+                gene_ids = GeneIds()
+                qualifiers_readable = True
+
+                def write(text: str):
+                    nonlocal qualifiers_readable
+                    out_f.write(text)
+                    if qualifiers_readable:
+                        qualifiers_readable = self._validate_locus_tag_qualifiers(
+                            text, new_locus_tag_prefix, path=out, gene_ids=gene_ids)
+            else:
+                write = out_f.write
 
-        assert new_locus_tag_prefix in content, f'Something went wrong: did not replace anything!'
+            n_replacements = stream_replace(chunks=chunks, write=write, replace_map=replace_map)
 
-        with open(out, 'w') as out_f:
-            out_f.write(content)
+        if n_replacements == 0:
+            os.remove(out)
+            raise AssertionError(f'The content of {self.path=} has not changed!')
+
+        if validate:
+            if qualifiers_readable:
+                self.gene_ids = gene_ids.sorted()
+            else:
+                # parse the whole output; the gene ids are left unset, so the file counts as not validated
+                GenBankFile(out).validate_locus_tags(new_locus_tag_prefix, strict=True)
+                self.gene_ids = None
 
         if update_path:
             self.path = out
 
-        if validate:
-            self.validate_locus_tags(locus_tag_prefix=new_locus_tag_prefix)
+    @staticmethod
+    def _reindex_scaffolds(in_f, scf_prefix: str, scf_leading_zeroes: int = None):
+        """
+        Generator that changes the VERSION lines to f'{scf_prefix}{counter}' and yields chunks of complete lines.
+        """
+        if type(scf_leading_zeroes) is int and scf_leading_zeroes > 1:
+            format = lambda c: f'VERSION     {scf_prefix}{str(c).zfill(scf_leading_zeroes)}\n'
+        else:
+            format = lambda c: f'VERSION     {scf_prefix}{c}\n'
+
+        counter = 0
+        while True:
+            lines = in_f.readlines(CHUNK_SIZE)
+            if not lines:
+                return
+            for i, line in enumerate(lines):
+                if line.startswith('VERSION'):
+                    counter += 1
+                    lines[i] = format(counter)
+            yield ''.join(lines)
 
     def create_ffn(self, ffn: str):
         GenBankToFasta.convert(gbk=self.path, out=ffn, format='ffn')
@@ -64,20 +132,103 @@ class GenBankFile(GenomeFile):
     def create_faa(self, faa: str):
         GenBankToFasta.convert(gbk=self.path, out=faa, format='faa')
 
-    def validate_locus_tags(self, locus_tag_prefix: str = None):
+    def create_fna(self, fna: str):
+        GenBankToFasta.convert_multiple(gbk=self.path, fna=fna)
+
+    def create_gff(self, gff: str):
+        GenBankToFasta.convert_multiple(gbk=self.path, gff=gff)
+
+    def create_files(self, faa: str = None, ffn: str = None, fna: str = None, gff: str = None, workers: int = 1):
+        """
+        Create any of faa, ffn, fna and gff with a single pass over the GenBank file.
+        """
+        GenBankToFasta.convert_multiple(gbk=self.path, faa=faa, ffn=ffn, fna=fna, gff=gff, workers=workers)
+
+    def validate_locus_tags(self, locus_tag_prefix: str = None, strict: bool = False):
+        """
+        Assert that all locus tags consist of locus_tag_prefix and digits.
+
+        By default, only the /locus_tag qualifier lines are read. If a qualifier cannot be read that way (e.g. because
+        its value spans multiple lines) or if strict is True, the whole file is parsed with Biopython.
+        """
         if locus_tag_prefix is None:
             locus_tag_prefix = self.detect_locus_tag_prefix()
 
-        with open(self.path) as f:
+        gene_ids = GeneIds()
+        if not strict and self._validate_locus_tag_lines(locus_tag_prefix, gene_ids=gene_ids):
+            self.gene_ids = gene_ids.sorted()
+            return
+
+        gene_ids = GeneIds()
+        with open_file(self.path) as f:
             for rec in SeqIO.parse(f, "genbank"):
                 for feature in rec.features:
                     locus_tag = feature.qualifiers.get('locus_tag')
                     if locus_tag is not None:
-                        locus_tag = locus_tag[0]
-                        real_locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
-                        assert real_locus_tag_prefix == locus_tag_prefix, \
-                            f'locus_tag_prefix in {self.path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
-                        assert gene_id.isdigit(), f'locus_tag in {self.path=} is malformed. expected: {locus_tag_prefix}_[0-9]+ reality: {locus_tag}'
+                        gene_ids.add(self._validate_locus_tag(locus_tag[0], locus_tag_prefix))
+        self.gene_ids = gene_ids.sorted()
+
+    def _validate_locus_tag_lines(self, locus_tag_prefix: str, gene_ids: GeneIds = None) -> bool:
+        """
+        Validate the /locus_tag qualifiers without parsing the file.
+
+        :param gene_ids: if set, add the gene ids of the locus tags
+        :return: False if some /locus_tag qualifiers could not be read, True if all of them are valid
+        """
+        binary = self._binary_mode()
+        encode = str.encode if binary else str
+        value_pattern = LOCUS_TAG_VALUE_BYTES if binary else LOCUS_TAG_VALUE
+        qualifier, newline = encode('/locus_tag='), encode('\n')
+        qualifier_line = encode(QUALIFIER_INDENT) + qualifier
+
+        with open_file(self.path, 'rb' if binary else 'rt') as f:
+            for block in iter_line_blocks(f):
+                # all occurrences of /locus_tag= must be single-line qualifiers
+                n_qualifiers = block.count(qualifier)
+                if n_qualifiers == 0:
+                    continue
+                n_lines = block.count(newline + qualifier_line) + block.startswith(qualifier_line)
+                locus_tags = value_pattern.findall(block)
+                if not n_qualifiers == n_lines == len(locus_tags):
+                    return False
+                self._validate_locus_tag_list(newline.join(locus_tags), locus_tag_prefix, gene_ids=gene_ids)
+        return True
+
+    def _validate_locus_tag_list(self, locus_tags: Union[str, bytes], locus_tag_prefix: str, path: str = None,
+                                 gene_ids: GeneIds = None) -> None:
+        """
+        :param locus_tags: locus tags, separated by newlines
+        :param gene_ids: if set, add the gene ids of the locus tags
+        """
+        if not locus_tags:
+            return
+        binary = type(locus_tags) is bytes
+        pattern = valid_locus_tag_pattern(locus_tag_prefix, binary=binary)
+        if pattern is not None:
+            newline = b'\n' if binary else '\n'
+            valid_gene_ids = pattern.findall(newline + locus_tags)
+            if len(valid_gene_ids) == locus_tags.count(newline) + 1:
+                # fast path: all locus tags are valid
+                if gene_ids is not None:
+                    gene_ids.extend(valid_gene_ids)
+                return
+        for locus_tag in to_str(locus_tags).split('\n'):
+            gene_id = self._validate_locus_tag(locus_tag, locus_tag_prefix, path=path)
+            if gene_ids is not None:
+                gene_ids.add(gene_id)
+
+    def _validate_locus_tag_qualifiers(self, text: str, locus_tag_prefix: str, path: str = None,
+                                       gene_ids: GeneIds = None) -> bool:
+        """
+        Validate all /locus_tag qualifiers in text, which must consist of complete lines of a GenBank file.
+
+        :return: False if some /locus_tag qualifiers could not be read (nothing is validated), True if all are valid
+        """
+        locus_tags = LOCUS_TAG_QUALIFIER.findall(text)
+        if len(locus_tags) != text.count('/locus_tag='):
+            return False
+        self._validate_locus_tag_list('\n'.join(locus_tags), locus_tag_prefix, path=path, gene_ids=gene_ids)
+        return True
 
     def metadata(self) -> (dict, dict):
         organism_data, genome_data = {}, {}
@@ -155,17 +306,27 @@ class GenBankFile(GenomeFile):
         strain, locus_tag_prefix = self.detect_strain_locus_tag_prefix()
         return locus_tag_prefix
 
+    def scan_qualifiers(self, *qualifiers: str) -> dict:
+        """
+        Read the feature tables until the first feature that has each qualifier is found. Header annotations and
+        sequences are not parsed.
+
+        :param qualifiers: names of the qualifiers, e.g. 'strain'
+        :return: dict: qualifier -> list of values of the first feature that has it. Missing qualifiers are omitted.
+        """
+        found = {}
+        with open_file(self.path) as f:
+            for feature_qualifiers in iter_feature_qualifiers(f):
+                for qualifier in qualifiers:
+                    if qualifier not in found and qualifier in feature_qualifiers:
+                        found[qualifier] = feature_qualifiers[qualifier]
+                if len(found) == len(qualifiers):
+                    break
+        return found
+
     def detect_strain_locus_tag_prefix(self) -> (str, str):
-        strain, locus_tag = None, None
-        with open(self.path) as f:
-            for rec in SeqIO.parse(f, "genbank"):
-                for feature in rec.features:
-                    if strain is None:
-                        strain = feature.qualifiers.get('strain')
-                    if locus_tag is None:
-                        locus_tag = feature.qualifiers.get('locus_tag')
-                    if strain is not None and locus_tag is not None:
-                        break
+        qualifiers = self.scan_qualifiers('strain', 'locus_tag')
+        strain, locus_tag = qualifiers.get('strain'), qualifiers.get('locus_tag')
 
         assert type(locus_tag) is list, f'Could not read genome from .gbk file! {locus_tag=}'
 
@@ -182,13 +343,97 @@ class GenBankFile(GenomeFile):
         assert type(locus_tag_prefix) is str and type(strain) is str
         return strain, locus_tag_prefix
 
+    def iter_record_offsets(self) -> Iterable[Tuple[str, int, int, int, int]]:
+        """
+        Yield the LOCUS name, byte offset, length in bytes, number of features and sequence length of each record.
+        Only the LOCUS lines and the beginning of the feature table lines are read. For compressed files, the offsets
+        refer to the decompressed file.
+        """
+        offset = 0
+        with open_file(self.path, 'rb') as f:
+            for chunk in iter_record_chunks(f):
+                start = 0 if chunk.startswith(b'LOCUS') else chunk.find(b'\nLOCUS') + 1 or None
+                while start is not None:
+                    end = chunk.find(b'\n//', start)
+                    end = len(chunk) if end == -1 else chunk.find(b'\n', end + 1) + 1 or len(chunk)
+
+                    locus_line = chunk[start:chunk.find(b'\n', start, end)].decode().split()
+                    assert len(locus_line) >= 2, f'Failed to read LOCUS line at byte {offset + start} of {self.path=}'
+                    unit = 'bp' if 'bp' in locus_line else 'aa'
+                    sequence_length = int(locus_line[locus_line.index(unit) - 1]) if unit in locus_line else 0
+
+                    n_features = 0
+                    features = chunk.find(b'\nFEATURES', start, end)
+                    if features != -1:
+                        table_end = KEYWORD_LINE.search(chunk, features + 1, end)
+                        table_end = end if table_end is None else table_end.start()
+                        n_features = len(FEATURE_KEY_LINE.findall(chunk, features, table_end))
+
+                    yield locus_line[1], offset + start, end - start, n_features, sequence_length
+
+                    start = chunk.find(b'\nLOCUS', end - 1) + 1 or None
+                offset += len(chunk)
+
+    def save_record_index(self, out: str = None) -> str:
+        """
+        Save the record index as a tab-separated file: LOCUS name, byte offset, length in bytes, number of features and
+        sequence length of each record.
+
+        :param out: output file, default: {self.path}.records.tsv
+        :return: path to the record index
+        """
+        if out is None:
+            out = self.path + RECORD_INDEX_SUFFIX
+        with open(out, 'w') as f:
+            f.writelines('\t'.join(map(str, record)) + '\n' for record in self.iter_record_offsets())
+        return out
+
+    def load_record_index(self, file: str = None) -> Dict[str, Tuple[int, int, int, int]]:
+        """
+        :param file: record index, default: {self.path}.records.tsv
+        :return: dict: LOCUS name -> tuple of byte offset, length in bytes, number of features and sequence length
+        """
+        if file is None:
+            file = self.path + RECORD_INDEX_SUFFIX
+        with open(file) as f:
+            return {name: tuple(map(int, values)) for name, *values in (line.rstrip('\n').split('\t') for line in f)}
+
+    def get_record(self, name: str) -> SeqRecord:
+        """
+        Read a single record (contig) without scanning the file, using the record index. If the index does not exist
+        or is older than the file, it is created first. Works for uncompressed and BGZF files (using {self.path}.gzi if
+        it exists); files compressed using plain gzip or zstd are decompressed up to the record.
+
+        :param name: LOCUS name of the record
+        """
+        index = self.path + RECORD_INDEX_SUFFIX
+        if self._record_index is None or self._record_index[0] != index:
+            if not os.path.isfile(index) or os.path.getmtime(index) < os.path.getmtime(self.path):
+                self.save_record_index(out=index)
+            self._record_index = index, self.load_record_index(index)
+
+        records = self._record_index[1]
+        assert name in records, f'Record does not exist! {name=} {self.path=}'
+        offset, length, n_features, sequence_length = records[name]
+        compression = detect_compression(self.path)
+        if compression is None:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        elif is_bgzf(self.path):
+            data = read_bgzf(self.path, offset, length)
+        else:
+            logging.warning(f'{self.path} is {compression} compressed and does not allow random access: reading record '
+                            f'{name} requires decompressing the file up to it. Use BGZF compression instead.')
+            with open_file(self.path, 'rb') as f:
+                f.seek(offset)
+                data = f.read(length)
+        return SeqIO.read(io.StringIO(data.decode()), 'genbank')
+
     @staticmethod
     def _get_first_gbk_rec_feature(gbk: str) -> (SeqRecord, SeqFeature):
-        with open(gbk) as f:
-            for rec in SeqIO.parse(f, "genbank"):
-                for feature in rec.features:
-                    return rec, feature
-        raise AssertionError(f'Failed to get rec and feature from {gbk=}')
+        summary = GenBankSummary.get(gbk)
+        return summary.first_record, summary.first_feature
 
 
 def rename_genbank(
@@ -1,4 +1,10 @@
-from .utils import GenomeFile, create_replace_function, split_locus_tag
+import io
+import os
+from typing import Iterable, Union, Optional
+
+from .utils import GenomeFile, GeneIds, split_locus_tag, stream_replace, open_file, to_str, CHUNK_SIZE
+
+GFF_SEPARATORS = {str: ('\n', '\t', ';'), bytes: (b'\n', b'\t', b';')}
 
 
 class NoLocusTagInGffLine(KeyError):
@@ -16,31 +22,48 @@ class GffFile(GenomeFile):
     ) -> None:
         old_locus_tag_prefix = self._pre_rename_check(out, new_locus_tag_prefix, old_locus_tag_prefix)
 
-        with open(self.path) as in_f:
-            content = in_f.read()
-
-        replace_fn = create_replace_function({
-            string.format(prefix=old_locus_tag_prefix): string.format(prefix=new_locus_tag_prefix)
+        binary = self._binary_mode()
+        encode = str.encode if binary else str
+        replace_map = {
+            encode(string.format(prefix=old_locus_tag_prefix)): encode(string.format(prefix=new_locus_tag_prefix))
             for string in ['-{prefix}', '={prefix}', ':{prefix}']
-        })
+        }
+
+        with open_file(self.path, 'rb' if binary else 'r') as in_f, \
+                open_file(out, 'wb' if binary else 'w') as out_f:
+            if validate:
+                # check the new locus tags while writing; the output is not read again
+                lines_to_validate = True
+                to_lines = io.BytesIO if binary else io.StringIO
+                gene_ids = GeneIds()
+
+                def write(text: Union[str, bytes]):
+                    nonlocal lines_to_validate
+                    out_f.write(text)
+                    if lines_to_validate:
+                        lines_to_validate = self._validate_lines(to_lines(text), new_locus_tag_prefix, path=out,
+                                                                 gene_ids=gene_ids)
+            else:
+                write = out_f.write
+
+            n_replacements = stream_replace(
+                chunks=iter(lambda: in_f.read(CHUNK_SIZE), encode('')),
+                write=write,
+                replace_map=replace_map
+            )
 
-        old_hash = hash(content)
-        content = replace_fn(content)
-        assert old_hash != hash(content), f'The content of {self.path=} has not changed!'
-
-        assert new_locus_tag_prefix in content, f'Something went wrong: did not replace anything!'
+        if validate:
+            self.gene_ids = gene_ids.sorted()
 
-        with open(out, 'w') as out_f:
-            out_f.write(content)
+        if n_replacements == 0:
+            os.remove(out)
+            raise AssertionError(f'The content of {self.path=} has not changed!')
 
         if update_path:
             self.path = out
 
-        if validate:
-            self.validate_locus_tags(locus_tag_prefix=new_locus_tag_prefix)
-
     def detect_locus_tag_prefix(self) -> str:
-        with open(self.path) as f:
+        with open_file(self.path) as f:
             for line in f:
                 if line.startswith('#'):
                     continue
@@ -53,31 +76,56 @@ class GffFile(GenomeFile):
         raise KeyError(f'Could not extract locus_tag from {self.path=}')
 
     def validate_locus_tags(self, locus_tag_prefix: str = None):
-        with open(self.path) as f:
-            for line in f:
-                if line == '##FASTA\n':
-                    break  # prokka
-                if line.startswith('#'):
-                    continue
-                try:
-                    real_locus_tag_prefix, gene_id = self._extract_gff_locus_tag(line)
-                except NoLocusTagInGffLine:
-                    continue  # in PGAP gffs, some lines contain no locus_tag
-                assert real_locus_tag_prefix == locus_tag_prefix, \
-                    f'locus_tag_prefix in {self.path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
+        gene_ids = GeneIds()
+        with open_file(self.path, 'rb' if self._binary_mode() else 'r') as f:
+            self._validate_lines(f, locus_tag_prefix, gene_ids=gene_ids)
+        self.gene_ids = gene_ids.sorted()
+
+    def _validate_lines(self, lines: Iterable[Union[str, bytes]], locus_tag_prefix: str, path: str = None,
+                        gene_ids: GeneIds = None) -> bool:
+        """
+        :param lines: lines as str or bytes
+        :param gene_ids: if set, add the gene ids of the locus tags
+        :return: False if the ##FASTA section was reached, i.e. the following lines need no validation
+        """
+        if path is None:
+            path = self.path
+        for line in lines:
+            if line.startswith(b'#' if type(line) is bytes else '#'):
+                if to_str(line) == '##FASTA\n':
+                    return False  # prokka
+                continue
+            try:
+                real_locus_tag_prefix, gene_id = self._extract_gff_locus_tag(line)
+            except NoLocusTagInGffLine:
+                continue  # in PGAP gffs, some lines contain no locus_tag
+            assert real_locus_tag_prefix == locus_tag_prefix, \
+                f'locus_tag_prefix in {path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
+            if gene_ids is not None:
+                gene_ids.add(gene_id)
+        return True
 
     @staticmethod
-    def _extract_gff_data(line: str) -> dict:
-        line = line.rstrip('\n').split('\t')
-        assert len(line) == 9, f'gff line is malformed! {len(line)=} {line=}'
-        return dict(info.split('=', 1) for info in line[8].split(';') if '=' in info)
+    def _extract_gff_attribute(line: Union[str, bytes], key: str) -> Optional[str]:
+        """
+        :param line: gff line as str or bytes
+        :param key: name of the attribute in column 9
+        :return: the value of the attribute (the last one if it occurs multiple times) or None
+        """
+        newline, tab, semicolon = GFF_SEPARATORS[type(line)]
+        columns = line.rstrip(newline).split(tab)
+        assert len(columns) == 9, f'gff line is malformed! {len(columns)=} line={to_str(line)!r}'
+        key = f'{key}='.encode() if type(line) is bytes else f'{key}='
+        for info in reversed(columns[8].split(semicolon)):
+            if info.startswith(key):
+                return to_str(info[len(key):])
+        return None
 
     @classmethod
-    def _extract_gff_locus_tag(cls, line: str) -> (str, str):
-        data = cls._extract_gff_data(line)
-        if 'locus_tag' not in data:
-            raise NoLocusTagInGffLine(f'gff data contains no locus_tag! {line}')
-        locus_tag = data['locus_tag']
+    def _extract_gff_locus_tag(cls, line: Union[str, bytes]) -> (str, str):
+        locus_tag = cls._extract_gff_attribute(line, 'locus_tag')
+        if locus_tag is None:
+            raise NoLocusTagInGffLine(f'gff data contains no locus_tag! {to_str(line)}')
         locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
         assert ' ' not in locus_tag_prefix, f'The locus_tag may not contain blanks! {locus_tag=}'
         return locus_tag_prefix, gene_id
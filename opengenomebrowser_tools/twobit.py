@@ -0,0 +1,227 @@
+import re
+import mmap
+import shutil
+import struct
+import tempfile
+from bisect import bisect_right
+from typing import List, Tuple, Dict
+
+from .utils import open_file, iter_line_blocks
+
+TWOBIT_SUFFIX = '.2bit'
+TWOBIT_SIGNATURE = 0x1A412743
+TWOBIT_BASES = b'TCAG'  # 2-bit codes 0, 1, 2, 3
+# any other character is stored as T (0), inside an N-block
+TWOBIT_CODES = bytes(max(TWOBIT_BASES.find(c), TWOBIT_BASES.lower().find(c), 0) for c in range(256))
+TWOBIT_SHIFTS = [bytes((c << shift) & 0xff for c in range(256)) for shift in (6, 4, 2, 0)]
+TWOBIT_DECODE = [bytes(TWOBIT_BASES[(c >> shift) & 3] for c in range(256)) for shift in (6, 4, 2, 0)]
+N_RUN = re.compile(rb'[^ACGTacgt]+')
+LOWER_CASE_RUN = re.compile(rb'[a-z]+')
+
+
+def pack_sequence(sequence: bytes) -> bytes:
+    """
+    Pack a nucleotide sequence into a UCSC .2bit sequence record: size, N-blocks, soft-mask blocks and the bases as
+    2-bit codes, four per byte, the first in the most significant bits. Works on the whole sequence at once.
+    """
+    # most assemblies have no N and no lower case: check this quickly before scanning for the blocks
+    others = sequence.translate(None, b'ACGT')
+    n_blocks, mask_blocks = [], []
+    if others.translate(None, b'acgt'):
+        n_blocks = [(match.start(), match.end() - match.start()) for match in N_RUN.finditer(sequence)]
+    if others != others.upper():
+        mask_blocks = [(match.start(), match.end() - match.start()) for match in LOWER_CASE_RUN.finditer(sequence)]
+
+    codes = sequence.translate(TWOBIT_CODES)
+    codes += bytes(-len(codes) % 4)
+    packed = 0
+    for i, shift_table in enumerate(TWOBIT_SHIFTS):
+        # the big integers combine the four codes of every byte in one operation
+        packed |= int.from_bytes(codes[i::4].translate(shift_table), 'big')
+
+    def pack_blocks(blocks: List[Tuple[int, int]]) -> bytes:
+        starts, sizes = zip(*blocks) if blocks else ((), ())
+        return struct.pack(f'<I{len(blocks)}I{len(blocks)}I', len(blocks), *starts, *sizes)
+
+    return b''.join((
+        struct.pack('<I', len(sequence)), pack_blocks(n_blocks), pack_blocks(mask_blocks),
+        struct.pack('<I', 0),  # reserved
+        packed.to_bytes(len(codes) // 4, 'big')
+    ))
+
+
+class TwoBitBuilder:
+    """
+    Create a UCSC-compatible .2bit file while a nucleotide FASTA file is streamed.
+
+    Feed it the content of the file in blocks of complete lines, from the start of the file, then call save. Only
+    the current sequence is kept in memory, the packed sequences are collected in a temporary file.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path  # only used in error messages
+        self.names: List[bytes] = []
+        self.record_sizes: List[int] = []
+        self._records = tempfile.TemporaryFile()
+        self._sequence: List[bytes] = []  # parts of the current sequence, without newlines
+
+    def feed(self, block: bytes) -> None:
+        first, *records = (b'\n' + block).split(b'\n>')
+        self._add_sequence(first)
+        for record in records:
+            header, _, sequence = record.partition(b'\n')
+            self._finish_sequence()
+            name = header.split(maxsplit=1)
+            assert name, f'FASTA header without name! {self.path=}'
+            assert len(name[0]) < 256, f'.2bit files do not support names longer than 255 bytes! {name[0]=}'
+            self.names.append(name[0])
+            self._add_sequence(sequence)
+
+    def _add_sequence(self, sequence: bytes) -> None:
+        sequence = sequence.replace(b'\n', b'').replace(b'\r', b'')
+        if sequence:
+            assert self.names, f'FASTA file does not start with a header! {self.path=}'
+            self._sequence.append(sequence)
+
+    def _finish_sequence(self) -> None:
+        if len(self.record_sizes) < len(self.names):
+            record = pack_sequence(b''.join(self._sequence))
+            self._records.write(record)
+            self.record_sizes.append(len(record))
+        self._sequence = []
+
+    def save(self, out: str) -> str:
+        self._finish_sequence()
+        header_size = 16 + sum(1 + len(name) + 4 for name in self.names)
+        assert header_size + sum(self.record_sizes) < 2 ** 32, f'Too much sequence for a .2bit file! {self.path=}'
+
+        with open(out, 'wb') as f:
+            f.write(struct.pack('<IIII', TWOBIT_SIGNATURE, 0, len(self.names), 0))
+            offset = header_size
+            for name, record_size in zip(self.names, self.record_sizes):
+                f.write(bytes([len(name)]) + name + struct.pack('<I', offset))
+                offset += record_size
+            self._records.seek(0)
+            shutil.copyfileobj(self._records, f)
+        self._records.close()
+        return out
+
+
+class TwoBitFile:
+    """
+    Random access to the sequences of a UCSC .2bit file. The file is memory-mapped: only the bytes of the requested
+    regions are read.
+
+    Example:
+
+    with TwoBitFile('assembly.2bit') as twobit:
+        sequence = twobit.get_sequence('scf_1', start=100, end=200)
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._endian = '<' if struct.unpack_from('<I', self._mm)[0] == TWOBIT_SIGNATURE else '>'
+        signature, version, n_sequences, reserved = struct.unpack_from(f'{self._endian}IIII', self._mm)
+        assert signature == TWOBIT_SIGNATURE and version == 0, f'Not a .2bit file! {path=}'
+
+        self.offsets: Dict[str, int] = {}
+        self._records: Dict[str, tuple] = {}
+        pos = 16
+        for _ in range(n_sequences):
+            name_size = self._mm[pos]
+            name = self._mm[pos + 1:pos + 1 + name_size].decode()
+            self.offsets[name] = struct.unpack_from(f'{self._endian}I', self._mm, pos + 1 + name_size)[0]
+            pos += 1 + name_size + 4
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _record(self, name: str) -> (int, list, list, int):
+        """
+        :return: number of bases, N-blocks, soft-mask blocks and byte offset of the packed bases
+        """
+        if name in self._records:
+            return self._records[name]
+        assert name in self.offsets, f'Sequence not in {self.path=}: {name=}'
+        pos = self.offsets[name]
+        size, n_count = struct.unpack_from(f'{self._endian}II', self._mm, pos)
+        n_blocks = struct.unpack_from(f'{self._endian}{2 * n_count}I', self._mm, pos + 8)
+        pos += 8 + 8 * n_count
+        mask_count = struct.unpack_from(f'{self._endian}I', self._mm, pos)[0]
+        mask_blocks = struct.unpack_from(f'{self._endian}{2 * mask_count}I', self._mm, pos + 4)
+        pos += 4 + 8 * mask_count + 4  # reserved
+        self._records[name] = size, _to_ranges(n_blocks), _to_ranges(mask_blocks), pos
+        return self._records[name]
+
+    def sequence_length(self, name: str) -> int:
+        return self._record(name)[0]
+
+    def get_sequence(self, name: str, start: int = 0, end: int = None) -> str:
+        """
+        :param name: name of the sequence
+        :param start: 0-based start position
+        :param end: 0-based end position (exclusive), default: end of the sequence
+        :return: the sequence, with N-blocks and soft-masked (lower-case) bases restored
+        """
+        size, n_blocks, mask_blocks, dna_offset = self._record(name)
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return ''
+
+        packed = self._mm[dna_offset + start // 4:dna_offset + (end + 3) // 4]
+        sequence = bytearray(4 * len(packed))
+        for i, decode_table in enumerate(TWOBIT_DECODE):
+            sequence[i::4] = packed.translate(decode_table)
+        sequence = sequence[start % 4:start % 4 + end - start]
+
+        for block_start, block_end in _overlapping(n_blocks, start, end):
+            sequence[block_start - start:block_end - start] = b'N' * (block_end - block_start)
+        for block_start, block_end in _overlapping(mask_blocks, start, end):
+            sequence[block_start - start:block_end - start] = sequence[block_start - start:block_end - start].lower()
+        return sequence.decode()
+
+
+def _to_ranges(blocks: tuple) -> List[Tuple[int, int]]:
+    """
+    Turn the starts and sizes of blocks into a sorted list of (start, end).
+    """
+    n = len(blocks) // 2
+    return [(block_start, block_start + size) for block_start, size in zip(blocks[:n], blocks[n:])]
+
+
+def _overlapping(ranges: List[Tuple[int, int]], start: int, end: int) -> List[Tuple[int, int]]:
+    """
+    :return: the parts of the sorted, non-overlapping ranges that lie within start and end
+    """
+    i = max(bisect_right(ranges, (start, start)) - 1, 0)
+    overlapping = []
+    for range_start, range_end in ranges[i:]:
+        if range_start >= end:
+            break
+        if range_end > start:
+            overlapping.append((max(range_start, start), min(range_end, end)))
+    return overlapping
+
+
+def save_2bit(fasta: str, out: str) -> str:
+    """
+    Create a UCSC-compatible .2bit file of a nucleotide FASTA file. Characters other than ACGT are stored as N, lower
+    case characters as soft-masked bases.
+
+    :param fasta: input FASTA file (may be compressed)
+    :param out: output file
+    :return: path to the .2bit file
+    """
+    builder = TwoBitBuilder(path=fasta)
+    with open_file(fasta, 'rb') as f:
+        for block in iter_line_blocks(f):
+            builder.feed(block)
+    return builder.save(out)
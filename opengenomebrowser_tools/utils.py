@@ -1,16 +1,22 @@
 import gzip
+import io
 import json
 import logging
+import mmap
 import os
 import re
+from array import array
 from datetime import datetime
+from functools import lru_cache
 from string import digits
-from typing import Union, Callable
+from typing import Union, Callable, Iterable, Optional
 
+import numpy as np
 from Bio import Entrez
 from termcolor import colored
 
 DATE_FORMAT = '%Y-%m-%d'
+CHUNK_SIZE = 2 ** 20  # characters per read when streaming large files
 TMPDIR = os.environ.get('TMPDIR', '/tmp')
 Entrez.email = os.environ.get('ENTREZ_EMAIL', 'opengenomebrowser@bioinformatics.unibe.ch')
 
@@ -46,9 +52,49 @@ class WorkingDirectory:
         os.chdir(self.old)
 
 
+class GeneIds:
+    """
+    Collect the gene ids of a file, i.e. the digits at the end of the locus tags, as integers in a compact array: 8
+    bytes per locus tag, about 1 MB for 100k genes.
+
+    The digits are stored as the integer 1{digits}, so leading zeros are preserved: 01 and 1 are different genes, as
+    they are different locus tags. Use GeneIds.digits to convert them back.
+    """
+    MAX_DIGITS = 18  # 1{digits} must fit into an unsigned 64-bit integer
+
+    def __init__(self):
+        self._ids = array('Q')
+
+    @classmethod
+    def key(cls, gene_id: Union[str, bytes]) -> int:
+        assert len(gene_id) <= cls.MAX_DIGITS, \
+            f'gene id is too long: {to_str(gene_id)}. Locus tags may end in at most {cls.MAX_DIGITS} digits.'
+        return int(b'1' + gene_id if type(gene_id) is bytes else '1' + gene_id)
+
+    @staticmethod
+    def digits(key: int) -> str:
+        return str(key)[1:]
+
+    def add(self, gene_id: Union[str, bytes]) -> None:
+        self._ids.append(self.key(gene_id))
+
+    def extend(self, gene_ids: Iterable[Union[str, bytes]]) -> None:
+        self._ids.extend(map(self.key, gene_ids))
+
+    def sorted(self) -> np.ndarray:
+        """
+        :return: the gene ids (see GeneIds.key) in ascending order, including duplicates
+        """
+        return np.sort(np.frombuffer(self._ids, dtype=np.uint64))
+
+
 class GenomeFile:
     original_path: str
     target_path: str
+    validated_locus_tag_prefix: str = None  # set if the locus tags of the file are known to be valid
+    gene_ids: np.ndarray = None  # sorted gene ids, see GeneIds. set whenever the locus tags are validated
+    binary: bool = True  # process files as bytes where possible; set to False to fall back to text mode
+    gzi: str = None  # BGZF index, set if the file was compressed using compress_bgzf
 
     def __init__(self, file: str, original_path: str = None):
         self.path = file
@@ -61,6 +107,20 @@ class GenomeFile:
     def metadata(self) -> (dict, dict):
         return {}, {}
 
+    def compress_bgzf(self) -> str:
+        """
+        Replace the file with a BGZF-compressed copy ({self.path}.gz) and its index ({self.path}.gz.gzi). The file can
+        still be read by all functions of this package.
+
+        :return: path to the BGZF index
+        """
+        from .bgzf import compress_bgzf
+        out = self.path + '.gz'
+        self.gzi = compress_bgzf(self.path, out=out)
+        os.remove(self.path)
+        self.path = out
+        return self.gzi
+
     def detect_locus_tag_prefix(self) -> str:
         raise NotImplementedError('This function must be overwritten.')
 
@@ -86,6 +146,32 @@ class GenomeFile:
 
         return old_locus_tag_prefix
 
+    def _binary_mode(self) -> bool:
+        """
+        Processing bytes is faster than processing text, as nothing needs to be decoded. Fall back to text mode if
+        self.binary is False or if the file contains a carriage return anywhere (e.g. Windows line endings), as only
+        text mode translates them.
+        """
+        if not self.binary:
+            return False
+        stat = os.stat(self.path)
+        return not _contains_carriage_return(self.path, stat.st_size, stat.st_mtime_ns)
+
+    def _validate_locus_tag(self, locus_tag: str, locus_tag_prefix: str, path: str = None) -> str:
+        """
+        Assert that locus_tag consists of locus_tag_prefix and digits.
+
+        :param path: file to mention in the error message, default: self.path
+        :return: the gene id (digits)
+        """
+        if path is None:
+            path = self.path
+        real_locus_tag_prefix, gene_id = split_locus_tag(locus_tag)
+        assert real_locus_tag_prefix == locus_tag_prefix, \
+            f'locus_tag_prefix in {path=} does not match. expected: {locus_tag_prefix} reality: {real_locus_tag_prefix}'
+        assert gene_id.isdigit(), f'locus_tag in {path=} is malformed. expected: {locus_tag_prefix}_[0-9]+ reality: {locus_tag}'
+        return gene_id
+
     def date(self) -> datetime:
         return get_ctime(file=self.path)
 
@@ -217,6 +303,32 @@ def entrez_organism_to_taxid(organism: str) -> int:
         return taxid
 
 
+def to_str(text: Union[str, bytes]) -> str:
+    return text.decode() if type(text) is bytes else text
+
+
+def iter_line_blocks(f, chunk_size: int = CHUNK_SIZE) -> Iterable[Union[str, bytes]]:
+    """
+    Read a file object (text or binary mode) chunk by chunk and yield blocks that consist of complete lines.
+    """
+    empty = f.read(0)  # '' or b''
+    newline = '\n' if type(empty) is str else b'\n'
+    pending = []  # incomplete line, collected in a list to avoid quadratic copying of very long lines
+    while True:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            if pending:
+                yield empty.join(pending)
+            return
+        cut = chunk.rfind(newline) + 1
+        if not cut:
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:cut])
+        yield empty.join(pending)
+        pending = [chunk[cut:]] if cut < len(chunk) else []
+
+
 def clean_locus_tag(locus_tag: str) -> (str):
     return locus_tag.rsplit('|', 1)[-1]
 
@@ -228,21 +340,194 @@ def split_locus_tag(locus_tag: str) -> (str, str):
     return prefix, locus_tag[len(prefix):]
 
 
+def _can_overlap(a: Union[str, bytes], b: Union[str, bytes]) -> bool:
+    """
+    :return: True if the end of a can be the beginning of b or vice versa
+    """
+    return any(a.endswith(b[:i]) or b.endswith(a[:i]) for i in range(1, min(len(a), len(b))))
+
+
+class MultiReplacer:
+    """
+    Precompiled replacer for multiple strings. Works on str and bytes.
+
+    The result is the same as that of a regular expression that is an alternation of all keys: the text is scanned
+    from left to right and at each position, the first key (in the order of replace_map) that matches is replaced.
+
+    Usually, the keys and values cannot interfere with each other, e.g. {'=tmp_': '=NEW_', ':tmp_': ':NEW_'}: no key can
+    overlap with another one and no value can form a later key. In this case, the keys are replaced one after another
+    using str.replace, which runs in C and needs no callback per match. Otherwise, the regular expression is used.
+    """
+    replace_map: dict
+    pattern: re.Pattern
+    sequential: bool
+
+    def __init__(self, replace_map: {str: str}):
+        assert len(replace_map) > 0, f'replace_map must not be empty!'
+        assert all(len(key) > 0 for key in replace_map.keys()), f'Cannot replace empty string! {replace_map=}'
+        self.replace_map = dict(replace_map)
+        keys, values = list(self.replace_map.keys()), list(self.replace_map.values())
+
+        separator = b'|' if type(keys[0]) is bytes else '|'
+        self.pattern = re.compile(separator.join(re.escape(key) for key in keys))
+
+        self.sequential = all(
+            # a key may contain a later key, but the alternation would also match the earlier (longer) key first
+            not _can_overlap(keys[i], keys[j]) and keys[i] not in keys[j] and
+            # a replacement must not create or destroy a later key
+            len(values[i]) > 0 and not _can_overlap(values[i], keys[j]) and
+            keys[j] not in values[i] and values[i] not in keys[j]
+            for i in range(len(keys)) for j in range(i + 1, len(keys))
+        )
+
+    def subn(self, text: Union[str, bytes]) -> (Union[str, bytes], int):
+        """
+        :return: the new text and the number of replacements
+        """
+        if self.sequential:
+            n_replacements = 0
+            for key, value in self.replace_map.items():
+                count = text.count(key)
+                if count:
+                    n_replacements += count
+                    text = text.replace(key, value)
+            return text, n_replacements
+        else:
+            get = self.replace_map.__getitem__
+            return self.pattern.subn(lambda m: get(m.group()), text)
+
+    def __call__(self, text: Union[str, bytes]) -> Union[str, bytes]:
+        return self.subn(text)[0]
+
+
 def create_replace_function(replace_map: {str: str}) -> Callable:
     '''
     Returns a function that will replace all replace_map.keys with their corresponding replace_map.values
 
     :param replace_map: dictionary that maps strings to be replaced to their desired replacement
     :rtype: Callable
-    :return: function that takes str and returns str
+    :return: function that takes str and returns str (or bytes and returns bytes)
     '''
-    replace_map = {re.escape(k): v for k, v in replace_map.items()}  # escape key
-    pattern = re.compile("|".join(replace_map.keys()))
+    return MultiReplacer(replace_map)
+
+
+def stream_replace(chunks: Iterable[str], write: Callable, replace_map: {str: str}) -> int:
+    '''
+    Replace all replace_map.keys with their corresponding replace_map.values in a stream of text.
+
+    The text is processed chunk by chunk, so memory usage depends on the size of the chunks, not on the size of the
+    whole text. To handle matches that span multiple chunks, the incomplete last line of each chunk is carried over
+    to the next one. Hence, the keys must not contain newlines. The result is the same as
+    create_replace_function(replace_map)(text). Works on str and bytes.
+
+    :param chunks: iterable of strings, e.g. iter(lambda: f.read(CHUNK_SIZE), '')
+    :param write: function that receives the processed text, e.g. out_f.write
+    :param replace_map: dictionary that maps strings to be replaced to their desired replacement
+    :return: number of replacements
+    '''
+    replacer = MultiReplacer(replace_map)
+    newline = b'\n' if type(next(iter(replace_map.keys()))) is bytes else '\n'
+    assert not any(newline in key for key in replace_map.keys()), f'Keys must not contain newlines! {replace_map=}'
+
+    n_replacements = 0
+    buffer = newline[:0]
+    for chunk in chunks:
+        buffer += chunk
+        cut = buffer.rfind(newline) + 1
+        if cut == 0:
+            continue
+        text, n = replacer.subn(buffer[:cut])
+        write(text)
+        n_replacements += n
+        buffer = buffer[cut:]
+
+    if buffer:
+        text, n = replacer.subn(buffer)
+        write(text)
+        n_replacements += n
+
+    return n_replacements
+
 
-    def replace_fn(text: str) -> str:
-        return pattern.sub(lambda m: replace_map[re.escape(m.group(0))], text)
+COMPRESSION_MAGIC_BYTES = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd'}
+COMPRESSION_SUFFIXES = {'.gz': 'gzip', '.zst': 'zstd'}
 
-    return replace_fn
+
+def detect_compression(file: str) -> Optional[str]:
+    """
+    Detect the compression of a file using its magic bytes.
+
+    :return: 'gzip', 'zstd' or None (uncompressed)
+    """
+    with open(file, 'rb') as f:
+        magic_bytes = f.read(4)
+    for compression, magic in COMPRESSION_MAGIC_BYTES.items():
+        if magic_bytes.startswith(magic):
+            return compression
+    return None
+
+
+def _import_zstd():
+    try:
+        from compression import zstd  # Python 3.14+
+        return zstd
+    except ImportError:
+        pass
+    try:
+        import zstandard
+        return zstandard
+    except ImportError:
+        raise ImportError('Python 3.14+ or the package zstandard is required to read or write zstd-compressed files. '
+                          'Install it like this: pip install zstandard')
+
+
+def open_file(file: str, mode: str = 'r', compression: str = None):
+    """
+    Open a file that may be compressed using gzip (including BGZF) or zstd. Works like open(file, mode).
+
+    :param file: path to the file
+    :param mode: 'r', 'rt', 'rb', 'w', 'wt' or 'wb'
+    :param compression: only for writing: 'gzip', 'bgzf', 'zstd' or None. default: determined by the suffix of file
+    (.gz, .zst)
+    :return: file object
+    """
+    assert mode in ('r', 'rt', 'rb', 'w', 'wt', 'wb'), f'Unsupported {mode=}'
+    binary = 'b' in mode
+    mode = mode[0]
+
+    if mode == 'r':
+        compression = detect_compression(file)
+    elif compression is None:
+        compression = COMPRESSION_SUFFIXES.get(os.path.splitext(file)[1])
+
+    if compression is None:
+        return open(file, mode + 'b' if binary else mode)
+    elif compression == 'gzip':
+        kwargs = {} if mode == 'r' else {'compresslevel': 6}
+        return gzip.open(file, mode + ('b' if binary else 't'), **kwargs)
+    elif compression == 'zstd':
+        return _import_zstd().open(file, mode + ('b' if binary else 't'))
+    elif compression == 'bgzf' and mode == 'w':
+        from .bgzf import BgzfWriter
+        f = BgzfWriter(file)
+        return f if binary else io.TextIOWrapper(io.BufferedWriter(f))
+    else:
+        raise AssertionError(f'Unknown {compression=}. Options: {list(COMPRESSION_MAGIC_BYTES)}')
+
+
+@lru_cache(maxsize=None)
+def _contains_carriage_return(file: str, size: int, mtime_ns: int) -> bool:
+    """
+    Whether a (possibly compressed) file contains b'\\r'. Cached, size and mtime_ns invalidate the cache if the file
+    changes.
+    """
+    if detect_compression(file) is None:
+        if size == 0:
+            return False
+        with open(file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return mm.find(b'\r') != -1
+    with open_file(file, 'rb') as f:
+        return any(b'\r' in chunk for chunk in iter(lambda: f.read(CHUNK_SIZE), b''))
 
 
 def decompress_gz(gz: str, out: str):
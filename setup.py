@@ -30,7 +30,8 @@ setup(
     ],
     packages=['opengenomebrowser_tools'],
     include_package_data=True,  # see MANIFEST.in
-    install_requires=['schema', 'biopython', 'termcolor', 'fire', 'pyyaml'],
+    install_requires=['schema', 'biopython', 'numpy', 'termcolor', 'fire', 'pyyaml'],
+    extras_require={'zstd': ['zstandard']},  # read/write zstd-compressed files with Python < 3.14
     entry_points={
         'console_scripts': [
             'init_folder_structure=opengenomebrowser_tools.init_folder_structure:main',
@@ -39,6 +40,7 @@ setup(
             'download_ncbi_genome=opengenomebrowser_tools.download_ncbi_genome:main',
             'genbank_to_fasta=opengenomebrowser_tools.genbank_to_fasta:main',
             'reindex_assembly=opengenomebrowser_tools.reindex_assembly:main',
+            'compress_bgzf=opengenomebrowser_tools.bgzf:main',
             'rename_custom_annotations=opengenomebrowser_tools.rename_custom_annotations:main',
             'rename_eggnog=opengenomebrowser_tools.rename_eggnog:main',
             'rename_fasta=opengenomebrowser_tools.rename_fasta:main',
@@ -0,0 +1,50 @@
+from unittest import TestCase
+
+import os
+import gzip
+from opengenomebrowser_tools.bgzf import *
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+TMPFILE = '/tmp/bgzf_test.fasta.gz'
+
+files = [
+    f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.ffn',
+    f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.gff',
+    f'{ROOT}/test-data/pgap-bad/annot.faa',
+]
+
+
+def cleanup():
+    for file in [TMPFILE, TMPFILE + GZI_SUFFIX]:
+        if os.path.isfile(file):
+            os.remove(file)
+
+
+class Test(TestCase):
+    def test_compress_bgzf(self):
+        for file in files:
+            cleanup()
+            gzi = compress_bgzf(file, out=TMPFILE)
+            self.assertTrue(is_bgzf(TMPFILE))
+            self.assertFalse(is_bgzf(file))
+            with open(file, 'rb') as f_raw, gzip.open(TMPFILE, 'rb') as f_bgzf:
+                self.assertEqual(f_bgzf.read(), f_raw.read())
+            with open(TMPFILE, 'rb') as f:
+                self.assertTrue(f.read().endswith(BGZF_EOF))
+            self.assertEqual(load_gzi(gzi), [(0, 0), *list(iter_bgzf_blocks(TMPFILE))[1:]])
+
+    def test_read_bgzf(self):
+        for file in files:
+            cleanup()
+            compress_bgzf(file, out=TMPFILE)
+            with open(file, 'rb') as f:
+                content = f.read()
+            gzi = load_gzi(TMPFILE + GZI_SUFFIX)
+            for offset, length in [(0, 10), (BGZF_BLOCK_SIZE - 5, 10), (100, 3 * BGZF_BLOCK_SIZE), (len(content) - 3, 10)]:
+                self.assertEqual(read_bgzf(TMPFILE, offset, length, gzi=gzi), content[offset:offset + length])
+                voffset = virtual_offset(gzi, offset)
+                self.assertEqual(voffset & 0xffff, offset % BGZF_BLOCK_SIZE)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cleanup()
@@ -1,8 +1,15 @@
 from unittest import TestCase
 
+import io
 import os
 import logging
-from opengenomebrowser_tools.genbank_to_fasta import GenBankToFasta
+from Bio import SeqIO
+from Bio.SeqRecord import SeqRecord
+from Bio.Seq import Seq
+from Bio.SeqFeature import SimpleLocation, CompoundLocation, BeforePosition, AfterPosition
+from opengenomebrowser_tools.genbank_to_fasta import GenBankToFasta, GenBankSummary, format_fasta, \
+    iter_record_chunks, extract_sequence, translate_cds, read_genbank_header, iter_features
+from opengenomebrowser_tools.rename_gff import GffFile
 
 logging.basicConfig(level=logging.INFO)
 
@@ -40,6 +47,37 @@ class TestGenBankToFasta(TestCase):
             for format in ['faa', 'ffn']:
                 self.convert_tester(gbk=gbk, format=format)
 
+    def test_convert_multiple(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            expected = {}
+            for format in ['faa', 'ffn']:
+                cleanup()
+                GenBankToFasta.convert(gbk=gbk, out=TMPFILE, format=format, strict=True)
+                with open(TMPFILE) as f:
+                    expected[format] = f.read()
+
+            cleanup()
+            GenBankToFasta.convert_multiple(gbk=gbk, faa=TMPFILE, ffn=TMPFILE + '.ffn', strict=True)
+            with open(TMPFILE) as f_faa, open(TMPFILE + '.ffn') as f_ffn:
+                self.assertEqual(f_faa.read(), expected['faa'])
+                self.assertEqual(f_ffn.read(), expected['ffn'])
+            os.remove(TMPFILE + '.ffn')
+            cleanup()
+
+    def test_convert_fna_gff(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            cleanup()
+            GenBankToFasta.convert_multiple(gbk=gbk, fna=TMPFILE, gff=TMPFILE + '.gff', strict=True)
+            with open(gbk) as f:
+                records = list(SeqIO.parse(f, 'genbank'))
+            with open(TMPFILE) as f:
+                self.assertEqual([str(rec.seq) for rec in SeqIO.parse(f, 'fasta')], [str(rec.seq) for rec in records])
+            gff = GffFile(TMPFILE + '.gff')
+            self.assertEqual(gff.detect_locus_tag_prefix(), locus_tag_prefix)
+            gff.validate_locus_tags(locus_tag_prefix=locus_tag_prefix)
+            os.remove(TMPFILE + '.gff')
+            cleanup()
+
     def long_fasta_tester(self, gbk, format, locus_tag_prefix):
         ALLOWED_CHARS = FAA_CHARS if format == 'faa' else FFN_CHARS
         for entry in GenBankToFasta._long_fasta_generator(gbk=gbk, format=format, strict=True):
@@ -81,3 +119,100 @@ class TestGenBankToFasta(TestCase):
             for format in ['faa', 'ffn']:
                 logging.info(f'testing {format=} {gbk=}')
                 self.short_fasta_tester(gbk=gbk, format=format, locus_tag_prefix=locus_tag_prefix)
+
+    def test_convert_parallel(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            cleanup()
+            GenBankToFasta.convert(gbk=gbk, out=TMPFILE, format='ffn', strict=True)
+            with open(TMPFILE) as f:
+                expected = f.read()
+
+            cleanup()
+            GenBankToFasta.convert(gbk=gbk, out=TMPFILE, format='ffn', strict=True, workers=2)
+            with open(TMPFILE) as f:
+                self.assertEqual(f.read(), expected)
+            cleanup()
+
+    def test_iter_record_chunks(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            with open(gbk) as f:
+                content = f.read()
+            chunks = list(iter_record_chunks(io.StringIO(content), chunk_size=1000))
+            self.assertEqual(''.join(chunks), content)
+            for chunk in chunks:
+                self.assertEqual(chunk.rstrip().rsplit('\n', 1)[-1], '//', msg='Chunk must end with a complete record')
+
+    def test_format_fasta(self):
+        for header, sequence in [('tmp_00001 product', 'A' * 130), ('tmp_00002 product ', 'ATG' * 20), ('tmp_00003', '')]:
+            expected = SeqRecord(Seq(sequence), id=header.split()[0], description=header.rstrip()).format('fasta')
+            self.assertEqual(format_fasta(header, sequence), expected)
+
+    def test_extract_sequence(self):
+        sequence = 'ATGCNRYSWKMBDHVUatgcnu' * 10
+        rec = SeqRecord(Seq(sequence))
+        locations = [
+            SimpleLocation(5, 50, strand=1),
+            SimpleLocation(5, 50, strand=-1),
+            SimpleLocation(BeforePosition(0), AfterPosition(30), strand=-1),
+            CompoundLocation([SimpleLocation(200, 220, strand=1), SimpleLocation(0, 20, strand=1)]),
+            CompoundLocation([SimpleLocation(100, 200, strand=-1), SimpleLocation(10, 50, strand=-1)]),
+            CompoundLocation([SimpleLocation(10, 20, strand=-1), SimpleLocation(30, 40, strand=1)]),
+        ]
+        for location in locations:
+            self.assertEqual(extract_sequence(location, sequence.encode()).decode(), str(location.extract(rec).seq))
+
+    def test_translate_cds(self):
+        for sequence, kwargs, expected in [
+            ('ATGAAATTTTAA', {}, 'MKF'),
+            ('GTGAAATTTTAA', {'table_id': 11}, 'MKF'),  # alternative start codon
+            ('GTGAAATTTTAA', {'table_id': 11, 'complete_start': False}, 'VKF'),
+            ('GTGAAATTTTAA', {'table_id': 1}, 'VKF'),  # GTG is no start codon in the standard code
+            ('CATGAAATGGATT', {'codon_start': 2}, 'MKWI'),
+            ('ATGTGAAAANNNTAA', {'table_id': 4}, 'MWKX'),  # TGA codes for tryptophan in table 4
+            ('atgaaatttta', {}, 'MKF'),  # incomplete codons at the end are ignored
+        ]:
+            self.assertEqual(translate_cds(sequence.encode(), **kwargs), expected, msg=f'{sequence=} {kwargs=}')
+
+    def test_read_genbank_header(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            with open(gbk) as f:
+                expected = next(SeqIO.parse(f, 'genbank'))
+            with open(gbk) as f:
+                rec = read_genbank_header(f)
+            self.assertEqual(rec.id, expected.id)
+            self.assertEqual(rec.annotations, expected.annotations)
+            self.assertEqual(rec.dbxrefs, expected.dbxrefs)
+            self.assertEqual(len(rec.seq), len(expected.seq))
+            self.assertEqual(len(rec.features), 1)
+            self.assertEqual(rec.features[0].qualifiers, expected.features[0].qualifiers)
+
+    def test_blank_lines_in_feature_table(self):
+        gbk = (
+            'LOCUS       scf1                      12 bp    DNA     linear   BCT 01-JAN-2021\n'
+            'FEATURES             Location/Qualifiers\n'
+            '     source          1..12\n'
+            '                     /organism="Test"\n'
+            '     \n'
+            '     CDS             1..12\n'
+            '                     /locus_tag="tmp_00001"\n'
+            '   \n'
+            '                     /product="hypothetical\n'
+            '                     protein"\n'
+            'ORIGIN\n'
+            '        1 atgaaattttaa\n'
+            '//\n'
+        )
+        self.assertEqual(list(iter_features(io.StringIO(gbk))), [
+            ('source', {'organism': ['Test']}),
+            ('CDS', {'locus_tag': ['tmp_00001'], 'product': ['hypothetical protein']}),
+        ])
+        rec = read_genbank_header(io.StringIO(gbk))
+        self.assertEqual([feature.type for feature in rec.features], ['source'])
+
+    def test_genbank_summary(self):
+        for gbk, locus_tag_prefix in GENBANK_FILES:
+            summary = GenBankSummary.get(gbk)
+            self.assertIs(GenBankSummary.get(gbk), summary, msg='GenBank file was parsed twice')
+            self.assertEqual(summary.first_feature.type, 'source')
+            self.assertIn('date', summary.annotations)
+            self.assertGreater(summary.feature_counts['CDS'], 0)
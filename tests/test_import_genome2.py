@@ -1,9 +1,13 @@
 import shutil
+import tempfile
+from types import SimpleNamespace
 from unittest import TestCase
 
 import os
 import logging
-from opengenomebrowser_tools.import_genome2 import import_genome2 as import_genome, ImportSettings2
+from opengenomebrowser_tools.import_genome2 import import_genome2 as import_genome, ImportSettings2, ImportException, \
+    check_gene_ids
+from opengenomebrowser_tools.utils import GeneIds
 
 logging.basicConfig(level=logging.INFO)
 
@@ -42,6 +46,10 @@ class Test(TestCase):
         import_genome(folder_structure_dir=FOLDER_STRUCTURE, import_dir=f'{ROOT}/test-data/prokka-bad',
                       organism='STRAIN', genome='STRAIN.1', rename=True)
 
+    def test_import_prokka_bad_parallel(self):
+        import_genome(folder_structure_dir=FOLDER_STRUCTURE, import_dir=f'{ROOT}/test-data/prokka-bad',
+                      organism='STRAIN', genome='STRAIN.1', rename=True, workers=4)
+
     def test_import_no_underline(self):
         import_genome(
             import_dir=f'{ROOT}/test-data/no-underline',
@@ -52,6 +60,35 @@ class Test(TestCase):
             check_files=True
         )
 
+    def test_import_duplicate_gene(self):
+        with tempfile.TemporaryDirectory() as tempdir:
+            import_dir = f'{tempdir}/prokka-bad'
+            shutil.copytree(f'{ROOT}/test-data/prokka-bad', import_dir)
+            faa = f'{import_dir}/PROKKA_08112021.faa'
+            with open(faa) as f:
+                content = f.read()
+            with open(faa, 'a') as f:
+                f.write(content[:content.index('\n>') + 1])  # first record again
+
+            with self.assertRaisesRegex(ImportException, 'genes occur more than once'):
+                import_genome(folder_structure_dir=FOLDER_STRUCTURE, import_dir=import_dir, organism='STRAIN',
+                              genome='STRAIN.1', rename=True, check_files=True)
+
+    def test_check_gene_ids_zero_padding(self):
+        def file(*digits):
+            gene_ids = GeneIds()
+            gene_ids.extend(digits)
+            return SimpleNamespace(gene_ids=gene_ids.sorted())
+
+        files = {'gbk': file('1', '1', '2'), 'gff': file('1', '2'), 'faa': file('1', '2'), 'ffn': file('1', '2')}
+        check_gene_ids(files, custom_annotations=[])
+
+        # 01 and 1 are different locus tags: 01 is unknown, not a duplicate of 1
+        files['faa'] = file('01', '1', '2')
+        with self.assertRaisesRegex(ImportException, r'1 genes do not occur in .*: 01$') as context:
+            check_gene_ids(files, custom_annotations=[])
+        self.assertNotIn('more than once', str(context.exception))
+
     def test_import_conflict(self):
         import_genome(folder_structure_dir=FOLDER_STRUCTURE, import_dir=f'{ROOT}/test-data/pgap-bad', organism='STRAIN',
                       genome='STRAIN.1', rename=True)
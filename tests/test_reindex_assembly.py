@@ -2,15 +2,18 @@ from unittest import TestCase
 
 import os
 from opengenomebrowser_tools.reindex_assembly import reindex_assembly
+from opengenomebrowser_tools.fasta_index import load_fai, save_fai, FaiBuilder
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 INFILE = f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.ffn'  # the assembly ASM2732v1.annotation.nucleotide.1.fasta has only one contig.
 TMPFILE = '/tmp/reindexed_assembly.fasta'
+TMPINFILE = '/tmp/assembly_to_reindex.fasta'
 
 
 def cleanup():
-    if os.path.isfile(TMPFILE):
-        os.remove(TMPFILE)
+    for file in [TMPFILE, TMPFILE + '.fai', TMPFILE + '.tsv', TMPINFILE, TMPINFILE + '.fai']:
+        if os.path.isfile(file):
+            os.remove(file)
 
 
 class Test(TestCase):
@@ -34,6 +37,56 @@ class Test(TestCase):
                     self.assertEqual(line, '>TEST_00002\n')
                     break
 
+    def test_reindex_assembly_fai_header_map(self):
+        reindex_assembly(file=INFILE, out=TMPFILE, prefix='TEST_', fai=TMPFILE + '.fai', header_map=TMPFILE + '.tsv')
+        with open(INFILE) as f:
+            old_headers = [line[1:].rstrip('\n') for line in f if line.startswith('>')]
+        with open(TMPFILE + '.tsv') as f:
+            self.assertEqual(f.read(), ''.join(f'{old}\tTEST_{i}\n' for i, old in enumerate(old_headers, start=1)))
+
+        with open(TMPFILE, 'rb') as f:
+            content = f.read()
+        fai = load_fai(TMPFILE + '.fai')
+        self.assertEqual([name for name, *_ in fai], [f'TEST_{i}' for i in range(1, len(old_headers) + 1)])
+        for name, length, offset, linebases, linewidth in fai:
+            end = content.find(b'>', offset)
+            sequence = content[offset:end if end != -1 else None]
+            self.assertEqual(length, len(sequence.replace(b'\n', b'')))
+            self.assertEqual(linewidth, len(sequence.split(b'\n', 1)[0]) + 1)
+
+    def test_reindex_assembly_crlf(self):
+        with open(TMPINFILE, 'wb') as f:
+            f.write(b'>a x\r\nACGT\r\nAC\r\n>b\r\nA\r\n')
+        reindex_assembly(file=TMPINFILE, out=TMPFILE, prefix='P', fai=TMPFILE + '.fai', header_map=TMPFILE + '.tsv')
+        with open(TMPFILE, 'rb') as f:
+            self.assertEqual(f.read(), b'>P1\nACGT\nAC\n>P2\nA\n')
+        self.assertEqual(load_fai(TMPFILE + '.fai'), [('P1', 6, 4, 4, 5), ('P2', 1, 16, 1, 2)])
+        with open(TMPFILE + '.tsv') as f:
+            self.assertEqual(f.read(), 'a x\tP1\nb\tP2\n')
+
+    def test_fai_uneven_lines(self):
+        with open(TMPINFILE, 'wb') as f:
+            f.write(b'>s1\nACG\nA\nA\nACG\n')
+        with self.assertRaisesRegex(AssertionError, 'Different line length'):
+            save_fai(TMPINFILE)
+
+    def test_fai_blank_lines(self):
+        # like samtools: blank lines are accepted at the end of a sequence, but not within
+        with open(TMPINFILE, 'wb') as f:
+            f.write(b'>s1\nACGT\nAC\n\n>s2\nACG\nA\n\n')
+        save_fai(TMPINFILE)
+        self.assertEqual(load_fai(TMPINFILE + '.fai'), [('s1', 6, 4, 4, 5), ('s2', 4, 17, 3, 4)])
+        with open(TMPINFILE, 'wb') as f:
+            f.write(b'>s1\nACGT\n\nAC\n')
+        with self.assertRaisesRegex(AssertionError, 'Blank line within sequence'):
+            save_fai(TMPINFILE)
+
+    def test_fai_builder_without_line_checks(self):
+        builder = FaiBuilder(count_bases=True, check_lines=False)
+        builder.feed(b'>s1\nACG\nA\nA\r\nACG\n\n>s2\nNN')
+        self.assertEqual([(name, length) for name, length, *_ in builder.entries], [('s1', 8), ('s2', 2)])
+        self.assertEqual(builder.assembly_stats()['assembly_size'], 10)
+
     def setUp(self) -> None:
         cleanup()
 
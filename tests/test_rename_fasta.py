@@ -1,10 +1,13 @@
 from unittest import TestCase
 
 import os
+import shutil
+from Bio import SeqIO
 from opengenomebrowser_tools.rename_fasta import *
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 TMPFILE = '/tmp/renamed_fasta.fasta'
+TMPINFILE = '/tmp/fasta_to_rename.fasta'
 
 fastas = [
     f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.',
@@ -47,6 +50,112 @@ class Test(TestCase):
                 second=max(content_old.count('tmp_'), content_old.count('STRAIN.1_'))
             )
 
+    def test_rename_validate(self):
+        for fasta in fastas:
+            cleanup()
+            # the new locus tags are validated while writing: 'YOLO_1' is not the prefix of 'YOLO_100001'
+            with self.assertRaises(AssertionError):
+                FastaFile(fasta).rename(new_locus_tag_prefix='YOLO_1', out=TMPFILE, validate=True)
+
+    def test_rename_text_mode(self):
+        for fasta in fastas:
+            cleanup()
+            FastaFile(fasta).rename(new_locus_tag_prefix='YOLO_', out=TMPFILE, validate=True)
+            with open(TMPFILE) as f:
+                content_binary = f.read()
+
+            cleanup()
+            file = FastaFile(fasta)
+            file.binary = False
+            file.rename(new_locus_tag_prefix='YOLO_', out=TMPFILE, validate=True)
+            with open(TMPFILE) as f:
+                content_text = f.read()
+
+            self.assertEqual(content_binary, content_text)
+
+    def test_rename_late_windows_line_endings(self):
+        # the first carriage return is far behind the start of the file: bytes mode must not be used
+        with open(TMPINFILE, 'wb') as f:
+            for i in range(1, 10001):
+                newline = b'\r\n' if i > 9000 else b'\n'
+                f.write(b'>tmp_%05d x' % i + newline + b'ACGT' * 5 + newline)
+        cleanup()
+        file = FastaFile(TMPINFILE)
+        self.assertFalse(file._binary_mode())
+        file.rename(new_locus_tag_prefix='NEW_', out=TMPFILE, validate=True)
+        with open(TMPFILE, 'rb') as f:
+            content = f.read()
+        os.remove(TMPINFILE)
+        self.assertNotIn(b'\r', content)
+        self.assertIn(b'>NEW_09999 x\nACGT', content)
+
+    def test_header_index(self):
+        for fasta in fastas:
+            cleanup()
+            file = FastaFile(fasta)
+            file.save_header_index(out=TMPFILE)
+            header_index = file.load_header_index(TMPFILE)
+            with open(fasta, 'rb') as f:
+                content = f.read()
+            self.assertEqual(len(header_index), content.count(b'>'))
+            for offset, header in header_index:
+                self.assertEqual(content[offset:offset + len(header) + 2], f'>{header}\n'.encode())
+
+    def test_save_indexes(self):
+        for fasta in fastas:
+            file = FastaFile(fasta)
+            locus_tag_prefix = file.detect_locus_tag_prefix()
+            fai, gzi = file.save_indexes(locus_tag_prefix=locus_tag_prefix)
+            self.assertEqual(fai, fasta + '.fai')
+            self.assertIsNone(gzi)
+            with open(fasta, 'rb') as f:
+                content = f.read()
+            with open(fai) as f:
+                entries = [line.rstrip('\n').split('\t') for line in f]
+            os.remove(fai)
+            self.assertEqual(len(entries), content.count(b'>'))
+            for name, length, offset, linebases, linewidth in entries:
+                offset, length, linebases, linewidth = int(offset), int(length), int(linebases), int(linewidth)
+                header_start = content.rfind(b'\n>', 0, offset - 1) + 1
+                self.assertEqual(content[header_start + 1:offset].split()[0].decode(), name)
+                last_base = offset + (length - 1) // linebases * linewidth + (length - 1) % linebases
+                self.assertNotIn(content[last_base:last_base + 1], [b'\n', b'>', b''])
+                self.assertIn(content[last_base + 1:last_base + 2], [b'\n', b''])
+
+    def test_save_indexes_stats(self):
+        for fasta in [fasta for fasta in fastas if fasta.endswith('.ffn')]:
+            file = FastaFile(fasta)
+            fai, gzi = file.save_indexes(count_bases=True)
+            os.remove(fai)
+            sequences = [str(record.seq).upper() for record in SeqIO.parse(fasta, 'fasta')]
+            lengths = sorted((len(sequence) for sequence in sequences), reverse=True)
+            self.assertEqual(file.stats['assembly_nr_scaffolds'], len(sequences))
+            self.assertEqual(file.stats['assembly_size'], sum(lengths))
+            self.assertEqual(file.stats['assembly_longest_scf'], lengths[0])
+            l50 = file.stats['assembly_l50']
+            self.assertEqual(file.stats['assembly_n50'], lengths[l50 - 1])
+            self.assertLess(2 * sum(lengths[:l50 - 1]), sum(lengths))
+            self.assertGreaterEqual(2 * sum(lengths[:l50]), sum(lengths))
+            gc = sum(sequence.count('G') + sequence.count('C') for sequence in sequences)
+            acgt = gc + sum(sequence.count('A') + sequence.count('T') for sequence in sequences)
+            self.assertEqual(file.stats['assembly_gc'], round(100 * gc / acgt, 2))
+
+    def test_get_sequence(self):
+        for fasta in fastas:
+            cleanup()
+            shutil.copy(fasta, TMPFILE)
+            file = FastaFile(TMPFILE)
+            file.save_indexes()
+            with open(fasta) as f:
+                expected = {rec.id: str(rec.seq) for rec in SeqIO.parse(f, 'fasta')}
+            file.compress_bgzf()
+            self.assertEqual(file.path, TMPFILE + '.gz')
+            for name, sequence in list(expected.items())[::50]:
+                self.assertEqual(file.get_sequence(name), sequence)
+                self.assertEqual(file.get_sequence(name, start=10, end=75), sequence[10:75])
+            for index in [file.path, file.fai, file.gzi]:
+                os.remove(index)
+
     @classmethod
     def tearDownClass(cls) -> None:
         cleanup()
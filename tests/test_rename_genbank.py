@@ -1,10 +1,13 @@
 from unittest import TestCase
 
 import os
+import gzip
 from opengenomebrowser_tools.rename_genbank import *
+from opengenomebrowser_tools.bgzf import compress_bgzf
 
 ROOT = os.path.dirname(os.path.dirname(__file__))
 TMPFILE = '/tmp/renamed_gbk.gbk'
+TMPINFILE = '/tmp/gbk_to_rename.gbk'
 
 gbks = [
     f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.gbk',
@@ -15,8 +18,27 @@ gbks = [
 
 
 def cleanup():
-    if os.path.isfile(TMPFILE):
-        os.remove(TMPFILE)
+    for file in [TMPFILE, TMPINFILE]:
+        if os.path.isfile(file):
+            os.remove(file)
+
+
+def write_gbk(*locus_tag_qualifiers: str) -> str:
+    """
+    Write a GenBank file with one gene per qualifier line(s), e.g. '/locus_tag="tmp_00001"'.
+    """
+    features = ''.join(f'     gene            1..12\n                     {qualifier}\n'
+                       for qualifier in locus_tag_qualifiers)
+    with open(TMPINFILE, 'w') as f:
+        f.write('LOCUS       scf1                      12 bp    DNA     linear   BCT 01-JAN-2021\n'
+                'FEATURES             Location/Qualifiers\n'
+                '     source          1..12\n'
+                '                     /strain="STRAIN"\n'
+                f'{features}'
+                'ORIGIN\n'
+                '        1 atgaaattttaa\n'
+                '//\n')
+    return TMPINFILE
 
 
 class Test(TestCase):
@@ -26,6 +48,68 @@ class Test(TestCase):
             self.assertIn(member=strain, container=['replaceme', 'STRAIN'])
             self.assertIn(member=locus_tag_prefix, container=['tmp_', 'STRAIN.1_'])
 
+    def test_iter_feature_qualifiers(self):
+        for gbk in gbks:
+            with open(gbk) as f:
+                expected = [feature.qualifiers for rec in SeqIO.parse(f, 'genbank') for feature in rec.features]
+            with open(gbk) as f:
+                self.assertEqual(list(iter_feature_qualifiers(f)), expected)
+
+    def test_validate_locus_tags(self):
+        for gbk in gbks:
+            file = GenBankFile(gbk)
+            locus_tag_prefix = file.detect_locus_tag_prefix()
+            for strict in [False, True]:
+                file.validate_locus_tags(locus_tag_prefix=locus_tag_prefix, strict=strict)
+                with self.assertRaises(AssertionError):
+                    file.validate_locus_tags(locus_tag_prefix='YOLO_', strict=strict)
+
+    def test_record_index(self):
+        for gbk in gbks:
+            cleanup()
+            file = GenBankFile(gbk)
+            file.save_record_index(out=TMPFILE)
+            record_index = file.load_record_index(TMPFILE)
+            with open(gbk) as f:
+                records = list(SeqIO.parse(f, 'genbank'))
+            self.assertEqual(list(record_index), [rec.name for rec in records])
+            for rec in records:
+                offset, length, n_features, sequence_length = record_index[rec.name]
+                self.assertEqual(n_features, len(rec.features))
+                self.assertEqual(sequence_length, len(rec.seq))
+
+    def test_get_record(self):
+        for gbk in gbks:
+            with open(gbk) as f:
+                expected = list(SeqIO.parse(f, 'genbank'))[-1]
+            file = GenBankFile(gbk)
+            record = file.get_record(expected.name)
+            os.remove(gbk + RECORD_INDEX_SUFFIX)
+            self.assertEqual(record.seq, expected.seq)
+            self.assertEqual(len(record.features), len(expected.features))
+
+    def test_get_record_compressed(self):
+        cleanup()
+        with open(write_gbk('/locus_tag="tmp_00001"')) as f:
+            record = f.read()
+        with open(TMPINFILE, 'w') as f:
+            f.write(record.replace('scf1', 'scf2') + record)
+        compress_bgzf(TMPINFILE, out=TMPINFILE + '.gz')
+        with open(TMPINFILE, 'rb') as f_in, gzip.open(TMPFILE + '.gz', 'wb') as f_out:
+            f_out.write(f_in.read())
+        try:
+            record = GenBankFile(TMPINFILE + '.gz').get_record('scf1')  # BGZF: random access
+            self.assertEqual(record.name, 'scf1')
+            self.assertEqual(str(record.seq), 'ATGAAATTTTAA')
+            with self.assertLogs(level='WARNING'):  # plain gzip: decompressed up to the record
+                record = GenBankFile(TMPFILE + '.gz').get_record('scf1')
+            self.assertEqual(record.name, 'scf1')
+        finally:
+            for file in [TMPINFILE + '.gz', TMPINFILE + '.gz.gzi', TMPINFILE + '.gz' + RECORD_INDEX_SUFFIX,
+                         TMPFILE + '.gz', TMPFILE + '.gz' + RECORD_INDEX_SUFFIX]:
+                if os.path.isfile(file):
+                    os.remove(file)
+
     def test_get_taxid(self):
         for gbk in gbks:
             self.assertEqual(GenBankFile(gbk).taxid(), 2097)
@@ -41,6 +125,21 @@ class Test(TestCase):
             self.assertNotIn(member='STRAIN.1_', container=content)
             self.assertGreater(a=count, b=1000)
 
+    def test_rename_validate_unreadable_qualifiers(self):
+        wrapped = '/locus_tag="WRONG_\n                     00002"'
+        unquoted = '/locus_tag=WRONG_00002'
+        for qualifier in [wrapped, unquoted]:
+            cleanup()
+            file = GenBankFile(write_gbk('/locus_tag="tmp_00001"', qualifier))
+            with self.assertRaises(AssertionError):
+                file.rename(out=TMPFILE, new_locus_tag_prefix='YOLO_', validate=True)
+
+        # valid, but not readable line by line: validated by parsing, gene ids are not collected
+        cleanup()
+        file = GenBankFile(write_gbk('/locus_tag="tmp_00001"', '/note="mentions /locus_tag="'))
+        file.rename(out=TMPFILE, new_locus_tag_prefix='YOLO_', validate=True)
+        self.assertIsNone(file.gene_ids)
+
     def test_rename_reindex(self):
         for gbk in gbks:
             cleanup()
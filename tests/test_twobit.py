@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+import os
+from Bio import SeqIO
+from opengenomebrowser_tools.twobit import *
+
+ROOT = os.path.dirname(os.path.dirname(__file__))
+INFILE = f'{ROOT}/test-data/prokka-bad/PROKKA_08112021.ffn'
+TMPFILE = '/tmp/twobit_test.2bit'
+TMPFASTA = '/tmp/twobit_test.fasta'
+
+
+def cleanup():
+    for file in [TMPFILE, TMPFASTA]:
+        if os.path.isfile(file):
+            os.remove(file)
+
+
+class Test(TestCase):
+    def test_save_2bit(self):
+        save_2bit(INFILE, out=TMPFILE)
+        with open(INFILE) as f:
+            expected = {rec.id: str(rec.seq) for rec in SeqIO.parse(f, 'fasta')}
+        with TwoBitFile(TMPFILE) as twobit:
+            self.assertEqual(list(twobit.offsets), list(expected))
+            for name, sequence in expected.items():
+                self.assertEqual(twobit.sequence_length(name), len(sequence))
+                self.assertEqual(twobit.get_sequence(name), sequence)
+                self.assertEqual(twobit.get_sequence(name, start=5, end=22), sequence[5:22])
+        self.assertLess(os.path.getsize(TMPFILE), os.path.getsize(INFILE) / 3)
+
+    def test_n_blocks_soft_mask(self):
+        sequences = {
+            'scf_1': 'ACGTNNNNNacgtnnACGTRYacgT',
+            'scf_2': 'nnnnACG',
+            'scf_3': 'A',
+            'scf_4': '',
+        }
+        with open(TMPFASTA, 'w') as f:
+            f.writelines(f'>{name} description\n{sequence[:10]}\n{sequence[10:]}\n' for name, sequence in sequences.items())
+        save_2bit(TMPFASTA, out=TMPFILE)
+        with TwoBitFile(TMPFILE) as twobit:
+            for name, sequence in sequences.items():
+                sequence = sequence.replace('R', 'N').replace('Y', 'N')  # other characters are stored as N
+                self.assertEqual(twobit.get_sequence(name), sequence)
+                for start in range(len(sequence)):
+                    for end in range(start, len(sequence) + 1):
+                        self.assertEqual(twobit.get_sequence(name, start, end), sequence[start:end])
+
+    def setUp(self) -> None:
+        cleanup()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cleanup()
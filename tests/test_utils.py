@@ -1,4 +1,5 @@
 from unittest import TestCase
+import io
 
 from opengenomebrowser_tools.utils import *
 
@@ -25,3 +26,61 @@ class Test(TestCase):
         result = replace_function(original)
 
         self.assertEqual(result, expected)
+
+    def test_multi_replacer(self):
+        # keys and values do not interfere: replaced one after another
+        replacer = MultiReplacer(replace_map={b'=tmp_': b'=NEW_', b':tmp_': b':NEW_'})
+        self.assertTrue(replacer.sequential)
+        self.assertEqual(replacer.subn(b'ID=tmp_001;Dbxref=COG:tmp_001'), (b'ID=NEW_001;Dbxref=COG:NEW_001', 2))
+
+        # value contains a later key: fall back to regular expression
+        replacer = MultiReplacer(replace_map={'a': 'b', 'b': 'c'})
+        self.assertFalse(replacer.sequential)
+        self.assertEqual(replacer.subn('aabb'), ('bbcc', 4))
+
+    def test_stream_replace(self):
+        original = 'One two three\nfour five six _six_\neight nine ten.\n'
+        replace_map = {
+            'One': 'Zero one',
+            '_six_': 'seven',
+            'ten': 'ten eleven',
+        }
+        expected = create_replace_function(replace_map=replace_map)(original)
+
+        for chunk_size in range(1, len(original) + 1):
+            result = []
+            n_replacements = stream_replace(
+                chunks=(original[i:i + chunk_size] for i in range(0, len(original), chunk_size)),
+                write=result.append,
+                replace_map=replace_map
+            )
+            self.assertEqual(''.join(result), expected, msg=f'{chunk_size=}')
+            self.assertEqual(n_replacements, 3)
+
+    def test_iter_line_blocks(self):
+        original = '>header 1\nACGT\n\n>header 2\nAC'
+        for content in [original, original.encode()]:
+            for chunk_size in range(1, len(original) + 1):
+                blocks = list(iter_line_blocks(io.BytesIO(content) if type(content) is bytes else io.StringIO(content),
+                                               chunk_size=chunk_size))
+                self.assertEqual(content[:0].join(blocks), content, msg=f'{chunk_size=}')
+                for block in blocks[:-1]:
+                    self.assertTrue(block.endswith(b'\n' if type(content) is bytes else '\n'), msg=f'{chunk_size=}')
+
+    def test_open_file(self):
+        for file, compression in [('/tmp/test_open_file.txt', None), ('/tmp/test_open_file.txt.gz', 'gzip')]:
+            with open_file(file, 'w') as f:
+                f.write('>locus_tag_00001\nATGC\n')
+            self.assertEqual(detect_compression(file), compression)
+            with open_file(file) as f:
+                self.assertEqual(f.read(), '>locus_tag_00001\nATGC\n')
+            os.remove(file)
+
+    def test_gene_ids(self):
+        gene_ids = GeneIds()
+        gene_ids.extend(['2', '01', b'1'])
+        gene_ids.add('1')
+        self.assertEqual([GeneIds.digits(key) for key in gene_ids.sorted()], ['1', '1', '2', '01'])
+        self.assertNotEqual(GeneIds.key('01'), GeneIds.key('1'))  # different locus tags
+        with self.assertRaises(AssertionError):
+            gene_ids.add('1' * (GeneIds.MAX_DIGITS + 1))